@@ -0,0 +1,212 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hashlib
+import httpx
+import json
+import os
+import time
+from dotenv import load_dotenv
+from cache import single_flight
+
+load_dotenv()
+
+# Serve member avatars through the backend instead of straight from the
+# PluralKit/Discord CDNs (set to false to hand out the original URLs)
+AVATAR_PROXY = os.getenv("AVATAR_PROXY", "true").strip().lower() in ("1", "true", "yes", "on")
+AVATAR_CACHE_DIR = os.getenv("AVATAR_CACHE_DIR", "data/avatar_cache")
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", 8 * 1024 * 1024))
+# Seconds a failed download is remembered, during which the proxy redirects
+# straight to the original URL instead of trying (and waiting) again
+AVATAR_FAILURE_TTL = float(os.getenv("AVATAR_FAILURE_TTL", 60))
+
+PROXY_PATH = "/api/avatar-proxy"
+
+# Remote avatar URLs are unique per image (a new avatar gets a new URL), so
+# the proxied copy of one never changes and browsers can keep it for good
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Only raster images are served; an SVG from our own origin could run scripts
+ALLOWED_CONTENT_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/avif"}
+
+# Headers for every proxied avatar, so browsers never treat one as anything but an image
+SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "default-src 'none'; sandbox",
+}
+
+# Layout of AVATAR_CACHE_DIR:
+#   urls/<url key>.json  - the remote URL, plus the content hash and type once fetched
+#   blobs/<sha256>       - image bytes, shared by every URL with the same content
+# Only URLs that went through proxy_url() have a urls/ entry, so the proxy
+# can't be used to fetch arbitrary URLs.
+_urls_dir = os.path.join(AVATAR_CACHE_DIR, "urls")
+_blobs_dir = os.path.join(AVATAR_CACHE_DIR, "blobs")
+
+# url key -> metadata, mirroring urls/ for the entries this process has seen
+_entries = {}
+
+# url key -> time until which downloading it isn't tried again
+_failures = {}
+
+_client = None
+
+def _url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+def _entry_path(key):
+    return os.path.join(_urls_dir, f"{key}.json")
+
+def _write_json(path, data):
+    # Write to a temporary file first so readers never see a half-written entry
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _load_entry(key):
+    entry = _entries.get(key)
+    if entry is None:
+        try:
+            with open(_entry_path(key), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        _entries[key] = entry
+    return entry
+
+def proxy_url(url):
+    """Local proxy URL for a remote avatar URL; other values are returned unchanged"""
+    if not AVATAR_PROXY or not isinstance(url, str) or not url.startswith(("https://", "http://")):
+        return url
+    key = _url_key(url)
+    if _load_entry(key) is None:
+        try:
+            os.makedirs(_urls_dir, exist_ok=True)
+            entry = {"url": url, "sha256": None, "content_type": None}
+            _write_json(_entry_path(key), entry)
+            _entries[key] = entry
+        except OSError as e:
+            print(f"Error registering avatar {url}: {e}")
+            return url
+    return f"{PROXY_PATH}/{key}"
+
+def proxy_member_avatars(members):
+    """Copies of members with avatar URLs (including cofront components) pointing at the proxy"""
+    if not AVATAR_PROXY:
+        return members
+    proxied = []
+    for member in members:
+        member = {**member, "avatar_url": proxy_url(member.get("avatar_url"))}
+        if member.get("component_avatars"):
+            member["component_avatars"] = [proxy_url(url) for url in member["component_avatars"]]
+        if member.get("component_members"):
+            member["component_members"] = [
+                {**component, "avatar_url": proxy_url(component.get("avatar_url"))}
+                for component in member["component_members"]
+            ]
+        proxied.append(member)
+    return proxied
+
+def _get_client():
+    global _client
+    if _client is None or _client.is_closed:
+        # Separate from the PluralKit client so the system token is never sent to CDNs
+        _client = httpx.AsyncClient(follow_redirects=True, timeout=httpx.Timeout(10, connect=5))
+    return _client
+
+async def shutdown():
+    """Close the avatar download client (called from the app lifespan)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def _download(key, entry):
+    async with _get_client().stream("GET", entry["url"]) as resp:
+        resp.raise_for_status()
+        content_type = resp.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in ALLOWED_CONTENT_TYPES:
+            raise ValueError(f"not a supported image type ({content_type or 'no content type'})")
+        chunks = []
+        size = 0
+        async for chunk in resp.aiter_bytes():
+            size += len(chunk)
+            if size > AVATAR_MAX_BYTES:
+                raise ValueError(f"larger than {AVATAR_MAX_BYTES} bytes")
+            chunks.append(chunk)
+    content = b"".join(chunks)
+
+    digest = hashlib.sha256(content).hexdigest()
+    blob_path = os.path.join(_blobs_dir, digest)
+    if not os.path.exists(blob_path):
+        os.makedirs(_blobs_dir, exist_ok=True)
+        tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, blob_path)
+
+    entry = {**entry, "sha256": digest, "content_type": content_type}
+    _write_json(_entry_path(key), entry)
+    _entries[key] = entry
+    return entry
+
+async def get_avatar(key):
+    """
+    Returns (path, content_type, url) for a proxied avatar, downloading it
+    on first use. path is None if the download failed, so the caller can
+    send the client to url instead. Returns None for unknown keys.
+    """
+    if len(key) != 32 or any(c not in "0123456789abcdef" for c in key):
+        return None
+    entry = _load_entry(key)
+    if entry is None:
+        return None
+    if not entry["sha256"]:
+        # Another worker may have downloaded it since we last read the entry
+        _entries.pop(key, None)
+        entry = _load_entry(key) or entry
+
+    if entry["sha256"]:
+        if entry["content_type"] not in ALLOWED_CONTENT_TYPES:
+            # Stored before the type was restricted
+            return None, None, entry["url"]
+        blob_path = os.path.join(_blobs_dir, entry["sha256"])
+        if os.path.exists(blob_path):
+            return blob_path, entry["content_type"], entry["url"]
+
+    if _failures.get(key, 0) > time.monotonic():
+        return None, None, entry["url"]
+    try:
+        # Concurrent first requests for the same avatar share one download
+        entry = await single_flight(f"avatar_{key}", lambda: _download(key, entry))
+    except Exception as e:
+        print(f"Error downloading avatar {entry['url']}: {e}")
+        now = time.monotonic()
+        for failed in [k for k, until in _failures.items() if until <= now]:
+            del _failures[failed]
+        _failures[key] = now + AVATAR_FAILURE_TTL
+        return None, None, entry["url"]
+    _failures.pop(key, None)
+    return os.path.join(_blobs_dir, entry["sha256"]), entry["content_type"], entry["url"]
@@ -22,19 +22,885 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
 import time
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from contextvars import ContextVar
+from dotenv import load_dotenv
 
-_cache = {}
+load_dotenv()
+
+# Default TTL for entries that don't specify one and have no namespace override
+CACHE_TTL = int(os.getenv("CACHE_TTL", 30))
+
+# Hard bounds on the cache so memory stays flat no matter how many
+# distinct keys (filters, limits, ...) clients make us create
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 512))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+# Stale-while-revalidate window (opt-in, 0 disables). For this many seconds
+# after an entry expires it is still served while a background task
+# refreshes it; after that the entry is hard-expired and callers wait.
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", 0))
+
+# How often (in seconds) expired entries are swept out
+CACHE_SWEEP_INTERVAL = int(os.getenv("CACHE_SWEEP_INTERVAL", 60))
+
+# Cache backend: "memory" (per process) or "sqlite" (shared by every worker
+# process on the host, e.g. when running uvicorn with --workers N)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "data/cache.db")
+
+# How long a failed upstream fetch is remembered, so an outage or error
+# doesn't turn every request into another upstream call
+CACHE_NEGATIVE_TTL = int(os.getenv("CACHE_NEGATIVE_TTL", 5))
+
+# Snapshot of key PluralKit resources persisted to the data/ volume so a
+# restarted container can serve them while it refreshes from PluralKit
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "data/cache_snapshot.json")
+# Snapshots older than this (seconds) are ignored at startup
+CACHE_SNAPSHOT_MAX_AGE = int(os.getenv("CACHE_SNAPSHOT_MAX_AGE", 24 * 3600))
+# How long loaded snapshot data may be served while it is being refreshed
+CACHE_SNAPSHOT_GRACE = int(os.getenv("CACHE_SNAPSHOT_GRACE", 300))
+
+# How long a worker waits on another worker's in-flight fetch before fetching itself
+CACHE_LEASE_TIMEOUT = int(os.getenv("CACHE_LEASE_TIMEOUT", 10))
+
+# How old the last good value of a key may be (seconds) and still be served
+# when fetching it fails, e.g. during a PluralKit outage (0 disables)
+CACHE_FALLBACK_MAX_AGE = int(os.getenv("CACHE_FALLBACK_MAX_AGE", 24 * 3600))
+
+def get_namespace(key):
+    """Namespace of a cache key, e.g. "members_None_True" -> "members" """
+    return key.split("_", 1)[0].split("!", 1)[0]
+
+def _load_namespace_ttls():
+    """Read per-namespace TTL overrides such as CACHE_TTL_MEMBERS=300"""
+    ttls = {}
+    for name, value in os.environ.items():
+        if name.startswith("CACHE_TTL_") and value.strip():
+            try:
+                ttls[name[len("CACHE_TTL_"):].lower()] = int(value)
+            except ValueError:
+                print(f"Ignoring invalid cache TTL {name}={value!r}")
+    return ttls
+
+NAMESPACE_TTLS = _load_namespace_ttls()
+
+def _estimate_size(value):
+    """Approximate size of a cached value in bytes"""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+class CacheEntry:
+    __slots__ = ("value", "expires_at", "stale_until", "size", "tags", "created_at")
+
+    def __init__(self, value, expires_at, stale_until, size, tags=()):
+        self.value = value
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.size = size
+        self.tags = frozenset(tags)
+        self.created_at = time.time()
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+class CacheBackend:
+    """
+    Interface every cache backend implements. Entries are CacheEntry
+    objects; values must be JSON-serialisable so they can be shared
+    between processes.
+    """
+
+    name = None
+
+    def __init__(self, default_ttl=CACHE_TTL, namespace_ttls=None):
+        self.default_ttl = default_ttl
+        self.namespace_ttls = dict(namespace_ttls or {})
+        # LRU evictions per namespace, counted by this process
+        self.evictions = Counter()
+
+    def ttl_for(self, key):
+        """TTL used for a key when the caller doesn't pass one"""
+        return self.namespace_ttls.get(get_namespace(key), self.default_ttl)
+
+    def get(self, key):
+        """Get a fresh value, or None if the key is missing or expired"""
+        entry = self.get_entry(key)
+        if entry is None or not entry.is_fresh():
+            return None
+        return entry.value
+
+    def get_entry(self, key):
+        """Get the entry for key, including one that is expired but still within its stale window"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None, stale_ttl=0, tags=()):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def invalidate(self, tag):
+        """Drop every entry tagged with tag, returning how many were dropped"""
+        raise NotImplementedError
+
+    def generation(self, tags):
+        """Snapshot of how often each tag has been invalidated"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def delete_namespace(self, namespace):
+        """Drop every entry in a namespace, returning how many were dropped"""
+        raise NotImplementedError
+
+    def describe(self):
+        """List (key, size, created_at, expires_at, stale_until) for every entry"""
+        raise NotImplementedError
+
+    def sweep(self):
+        """Drop every expired entry"""
+        raise NotImplementedError
+
+    def acquire_lease(self, key, timeout):
+        """
+        Claim the right to fetch key across processes. Returns False if
+        another process holds an unexpired lease for it.
+        """
+        return True
+
+    def release_lease(self, key):
+        pass
+
+class TTLCache(CacheBackend):
+    """
+    Bounded in-memory cache with LRU eviction and per-entry expiry.
+    Entries are evicted least-recently-used first once either the entry
+    count or the approximate byte size goes over its limit, and expired
+    entries are swept out periodically instead of only on read.
+
+    Entries can carry dependency tags; invalidate(tag) drops every entry
+    with that tag using a tag -> keys index.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                 default_ttl=CACHE_TTL, namespace_ttls=None, sweep_interval=CACHE_SWEEP_INTERVAL):
+        super().__init__(default_ttl, namespace_ttls)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._tag_generations = {}
+        self._bytes = 0
+        self._last_sweep = time.time()
+        self._lock = threading.RLock()
+
+    def get_entry(self, key):
+        with self._lock:
+            self._maybe_sweep()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() >= entry.stale_until:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl=None, stale_ttl=0, tags=()):
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        with self._lock:
+            self._maybe_sweep()
+            if key in self._entries:
+                self._remove(key)
+            if ttl <= 0 and stale_ttl <= 0:
+                # A non-positive TTL with no stale window is used to drop an entry
+                return
+            size = _estimate_size(value)
+            if size > self.max_bytes:
+                print(f"Not caching {key}: {size} bytes exceeds the cache size limit")
+                return
+            expires_at = time.time() + ttl
+            entry = CacheEntry(value, expires_at, expires_at + max(stale_ttl, 0), size, tags)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._bytes += size
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate(self, tag):
+        with self._lock:
+            self._tag_generations[tag] = self._tag_generations.get(tag, 0) + 1
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def generation(self, tags):
+        with self._lock:
+            return tuple(self._tag_generations.get(tag, 0) for tag in tags)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def delete_namespace(self, namespace):
+        with self._lock:
+            keys = [key for key in self._entries if get_namespace(key) == namespace]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def describe(self):
+        with self._lock:
+            return [
+                (key, entry.size, entry.created_at, entry.expires_at, entry.stale_until)
+                for key, entry in self._entries.items()
+            ]
+
+    def sweep(self):
+        with self._lock:
+            now = time.time()
+            self._last_sweep = now
+            expired = [key for key, entry in self._entries.items() if now >= entry.stale_until]
+            for key in expired:
+                self._remove(key)
+            return len(expired)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            self._untag(key, entry)
+
+    def _untag(self, key, entry):
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self._untag(key, entry)
+            self.evictions[get_namespace(key)] += 1
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache shared between worker processes through a SQLite database in WAL
+    mode. Invalidations, tag generations and fetch leases live in the
+    database too, so they apply to every worker at once. Eviction is LRU
+    on last access time, bounded like the in-memory cache.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            stale_until REAL NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+        CREATE INDEX IF NOT EXISTS entries_stale_until ON entries(stale_until);
+        CREATE TABLE IF NOT EXISTS entry_tags (
+            tag TEXT NOT NULL,
+            key TEXT NOT NULL REFERENCES entries(key) ON DELETE CASCADE,
+            PRIMARY KEY (tag, key)
+        );
+        CREATE INDEX IF NOT EXISTS entry_tags_key ON entry_tags(key);
+        CREATE TABLE IF NOT EXISTS tag_generations (
+            tag TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            key TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path=CACHE_DB_PATH, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                 default_ttl=CACHE_TTL, namespace_ttls=None, sweep_interval=CACHE_SWEEP_INTERVAL):
+        super().__init__(default_ttl, namespace_ttls)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0
+        self._lock = threading.RLock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(self.SCHEMA)
+
+    def _transaction(self, immediate=True):
+        return _SQLiteTransaction(self._conn, self._lock, immediate)
+
+    def get_entry(self, key):
+        self._maybe_sweep()
+        now = time.time()
+        with self._transaction(immediate=False) as conn:
+            row = conn.execute(
+                "SELECT value, expires_at, stale_until, size, created_at, last_access FROM entries WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at, stale_until, size, created_at, last_access = row
+            if now >= stale_until:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            # Only bump the LRU clock occasionally so hot reads don't all turn into writes
+            if now - last_access >= 1:
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            tags = [tag for (tag,) in conn.execute("SELECT tag FROM entry_tags WHERE key = ?", (key,))]
+        entry = CacheEntry(json.loads(value), expires_at, stale_until, size, tags)
+        entry.created_at = created_at
+        return entry
+
+    def set(self, key, value, ttl=None, stale_ttl=0, tags=()):
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        self._maybe_sweep()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            if ttl <= 0 and stale_ttl <= 0:
+                # A non-positive TTL with no stale window is used to drop an entry
+                return
+            encoded = json.dumps(value, default=str)
+            size = len(encoded)
+            if size > self.max_bytes:
+                print(f"Not caching {key}: {size} bytes exceeds the cache size limit")
+                return
+            now = time.time()
+            expires_at = now + ttl
+            conn.execute(
+                "INSERT INTO entries (key, value, expires_at, stale_until, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, encoded, expires_at, expires_at + max(stale_ttl, 0), size, now, now)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO entry_tags (tag, key) VALUES (?, ?)",
+                [(tag, key) for tag in set(tags)]
+            )
+            self._evict(conn)
+
+    def delete(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def invalidate(self, tag):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO tag_generations (tag, generation) VALUES (?, 1) "
+                "ON CONFLICT(tag) DO UPDATE SET generation = generation + 1",
+                (tag,)
+            )
+            cursor = conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entry_tags WHERE tag = ?)",
+                (tag,)
+            )
+            return cursor.rowcount
+
+    def generation(self, tags):
+        if not tags:
+            return ()
+        with self._transaction() as conn:
+            placeholders = ",".join("?" for _ in tags)
+            rows = dict(conn.execute(
+                f"SELECT tag, generation FROM tag_generations WHERE tag IN ({placeholders})",
+                tuple(tags)
+            ).fetchall())
+        return tuple(rows.get(tag, 0) for tag in tags)
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def delete_namespace(self, namespace):
+        with self._transaction() as conn:
+            keys = [(key,) for (key,) in conn.execute("SELECT key FROM entries") if get_namespace(key) == namespace]
+            conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            return len(keys)
+
+    def describe(self):
+        with self._transaction(immediate=False) as conn:
+            return conn.execute(
+                "SELECT key, size, created_at, expires_at, stale_until FROM entries"
+            ).fetchall()
+
+    def sweep(self):
+        self._last_sweep = time.time()
+        with self._transaction() as conn:
+            now = time.time()
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+            return conn.execute("DELETE FROM entries WHERE stale_until <= ?", (now,)).rowcount
+
+    def acquire_lease(self, key, timeout):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO leases (key, expires_at) VALUES (?, ?)",
+                (key, now + timeout)
+            )
+            return cursor.rowcount == 1
+
+    def release_lease(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def size_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def _evict(self, conn):
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        while count > 0 and (count > self.max_entries or total > self.max_bytes):
+            key, size = conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access LIMIT 1"
+            ).fetchone()
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.evictions[get_namespace(key)] += 1
+            count -= 1
+            total -= size
+
+class _SQLiteTransaction:
+    """Serialise access to the shared connection and wrap it in a transaction"""
+
+    def __init__(self, conn, lock, immediate=True):
+        self._conn = conn
+        self._lock = lock
+        self._immediate = immediate
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._conn.execute("BEGIN IMMEDIATE" if self._immediate else "BEGIN")
+        except Exception:
+            self._lock.release()
+            raise
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+
+def create_backend(name=CACHE_BACKEND):
+    if name == "sqlite":
+        print(f"Using shared SQLite cache at {CACHE_DB_PATH}")
+        return SQLiteBackend(CACHE_DB_PATH, namespace_ttls=NAMESPACE_TTLS)
+    if name != "memory":
+        print(f"Unknown CACHE_BACKEND {name!r}, falling back to memory")
+    return TTLCache(namespace_ttls=NAMESPACE_TTLS)
+
+_cache = create_backend()
+
+# Result of a cache lookup. hit is True whenever an entry exists (even if
+# its value is None, [] or {}); stale is True when it is past its TTL but
+# still within its stale window.
+CacheResult = namedtuple("CacheResult", ["hit", "value", "stale"])
+MISS = CacheResult(False, None, False)
+
+# Lookup outcomes per namespace, counted by this process
+_stats = defaultdict(Counter)
+
+def _record(key, outcome):
+    _stats[get_namespace(key)][outcome] += 1
+
+class CachedFetchError(Exception):
+    """Raised while a recent upstream failure for a key is negatively cached"""
+
+def lookup(key, allow_stale=False):
+    """Look up key, telling a cached empty/None value apart from a miss"""
+    entry = _cache.get_entry(key)
+    if entry is None:
+        return MISS
+    if entry.is_fresh():
+        return CacheResult(True, entry.value, False)
+    if allow_stale:
+        return CacheResult(True, entry.value, True)
+    return MISS
 
 def get_from_cache(key):
-    if key in _cache:
-        value, expire_time = _cache[key]
-        if time.time() < expire_time:
-            return value
-        else:
-            del _cache[key]  # expired
-    return None
-
-def set_in_cache(key, value, ttl=30):
-    expire_time = time.time() + ttl
-    _cache[key] = (value, expire_time)
+    """Get a fresh value or None. Use lookup() when None/empty values are meaningful."""
+    cached = lookup(key)
+    _record(key, "hits" if cached.hit else "misses")
+    return cached.value
+
+def set_in_cache(key, value, ttl=None, stale_ttl=0, tags=()):
+    _cache.set(key, value, ttl, stale_ttl, tags)
+    if (ttl is None or ttl > 0) and not key.endswith("!error"):
+        _remember(key, value)
+
+# Last value stored for each key and when, kept in this process after the
+# cache entry itself expires or is invalidated, so cached_fetch can fall back
+# on it when the upstream fetch fails
+_last_good = OrderedDict()
+
+# Keys served from _last_good in the current request, with their ages
+_stale_reads = ContextVar("stale_reads", default=None)
+
+def _remember(key, value, stored_at=None):
+    if CACHE_FALLBACK_MAX_AGE <= 0:
+        return
+    _last_good[key] = (value, stored_at or time.time())
+    _last_good.move_to_end(key)
+    while len(_last_good) > CACHE_MAX_ENTRIES:
+        _last_good.popitem(last=False)
+
+def _fallback(key):
+    """The last good value of key if it isn't too old, else MISS"""
+    remembered = _last_good.get(key)
+    if remembered is None:
+        return MISS
+    value, stored_at = remembered
+    age = time.time() - stored_at
+    if age > CACHE_FALLBACK_MAX_AGE:
+        return MISS
+    served = _stale_reads.get()
+    if served is not None:
+        served[key] = max(age, served.get(key, 0))
+    return CacheResult(True, value, True)
+
+def track_stale_reads():
+    """
+    Start collecting the keys served from fallback data in the current
+    context (e.g. one request). Returns a dict that fills up with
+    key -> age in seconds.
+    """
+    served = {}
+    _stale_reads.set(served)
+    return served
+
+def invalidate(tag):
+    """Drop every cached entry that depends on tag"""
+    return _cache.invalidate(tag)
+
+def _error_key(key):
+    # Negative results live next to the entry so they never clobber the last good value
+    return f"{key}!error"
+
+def _check_negative(key):
+    error = lookup(_error_key(key))
+    if error.hit:
+        raise CachedFetchError(error.value)
+
+# Upstream fetches currently in flight, keyed by cache key
+_inflight = {}
+
+async def single_flight(key, fetch):
+    """
+    Run fetch() for key, unless a fetch for the same key is already running,
+    in which case wait for that one instead. Every waiter gets the same
+    result (or exception) so concurrent misses cause one upstream call.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _inflight[key] = task
+
+        def _done(_):
+            if _inflight.get(key) is task:
+                del _inflight[key]
+
+        task.add_done_callback(_done)
+    # Shield so a cancelled waiter (e.g. a client disconnect) doesn't cancel everyone else's fetch
+    return await asyncio.shield(task)
+
+# Background refresh tasks, kept referenced so they aren't garbage collected mid-flight
+_refresh_tasks = set()
+
+# Set inside background refresh tasks so lower layers can deprioritise their work
+_background_refresh = ContextVar("background_refresh", default=False)
+
+def is_background_refresh():
+    """True when running inside a stale-while-revalidate background refresh"""
+    return _background_refresh.get()
+
+async def cached_fetch(key, fetch, ttl=None, stale_ttl=None, tags=()):
+    """
+    Return the cached value for key, or fetch and cache it. Concurrent
+    misses for the same key share a single fetch.
+
+    With a stale window (stale_ttl, default CACHE_STALE_TTL) an expired
+    value is returned immediately while it is refreshed in the background,
+    until the window runs out and callers have to wait for a fetch again.
+
+    If fetch() raises, the failure is cached for CACHE_NEGATIVE_TTL seconds
+    and callers get a CachedFetchError instead of retrying upstream. While
+    fetching fails, the last good value (up to CACHE_FALLBACK_MAX_AGE old)
+    is returned instead of raising, and noted in track_stale_reads().
+
+    tags are the dependencies of the value; see invalidate().
+    """
+    if stale_ttl is None:
+        stale_ttl = CACHE_STALE_TTL
+
+    async def load():
+        # Another flight may have filled the cache while we were scheduled
+        cached = lookup(key)
+        if cached.hit:
+            return cached.value
+        # With a shared backend, another worker may already be fetching this key
+        if not _cache.acquire_lease(key, CACHE_LEASE_TIMEOUT):
+            cached = await _wait_for_peer(key)
+            if cached.hit:
+                return cached.value
+        try:
+            return await _fetch_and_store(key, fetch, ttl, stale_ttl, tags)
+        finally:
+            _cache.release_lease(key)
+
+    cached = lookup(key, allow_stale=True)
+    if cached.hit:
+        _record(key, "stale_hits" if cached.stale else "hits")
+        if cached.stale and not lookup(_error_key(key)).hit:
+            _refresh_in_background(key, load)
+        return cached.value
+
+    try:
+        try:
+            _check_negative(key)
+        except CachedFetchError:
+            _record(key, "negative_hits")
+            raise
+        _record(key, "misses")
+        return await single_flight(key, load)
+    except Exception:
+        fallback = _fallback(key)
+        if not fallback.hit:
+            raise
+        _record(key, "fallback_hits")
+        return fallback.value
+
+async def refresh_cached(key, fetch, ttl=None, stale_ttl=None, tags=()):
+    """
+    Fetch key now, even if it is cached, then store and return it. Joins a
+    fetch for the same key that is already in flight.
+    """
+    if stale_ttl is None:
+        stale_ttl = CACHE_STALE_TTL
+    return await single_flight(key, lambda: _fetch_and_store(key, fetch, ttl, stale_ttl, tags))
+
+async def _fetch_and_store(key, fetch, ttl, stale_ttl, tags):
+    generation = _cache.generation(tags)
+    try:
+        value = await fetch()
+    except Exception as e:
+        set_in_cache(_error_key(key), str(e) or type(e).__name__, CACHE_NEGATIVE_TTL, 0, tags)
+        raise
+    # Don't store a value whose dependencies were invalidated mid-fetch
+    if _cache.generation(tags) == generation:
+        set_in_cache(key, value, ttl, stale_ttl, tags)
+    return value
+
+def acquire_lease(key, timeout):
+    """Claim key for timeout seconds across worker processes; False if someone else holds it"""
+    return _cache.acquire_lease(key, timeout)
+
+async def _wait_for_peer(key):
+    """Wait for another process's fetch of key to land in the shared cache"""
+    deadline = time.time() + CACHE_LEASE_TIMEOUT
+    while time.time() < deadline:
+        await asyncio.sleep(0.05)
+        cached = lookup(key)
+        if cached.hit:
+            return cached
+        # The other worker's fetch failed; share its failure rather than retrying
+        _check_negative(key)
+        if _cache.acquire_lease(key, CACHE_LEASE_TIMEOUT):
+            # The other fetch gave up without storing anything; it's our turn
+            return MISS
+    # Took too long; fetch it ourselves rather than keep the caller waiting
+    return MISS
+
+def _refresh_in_background(key, load):
+    if key in _inflight:
+        return
+
+    async def refresh():
+        _background_refresh.set(True)
+        try:
+            await single_flight(key, load)
+        except Exception as e:
+            print(f"Background refresh of {key} failed: {e}")
+
+    task = asyncio.ensure_future(refresh())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+async def wait_for_refreshes():
+    """Wait for every background refresh that is currently running"""
+    if _refresh_tasks:
+        await asyncio.gather(*list(_refresh_tasks), return_exceptions=True)
+
+def save_snapshot(keys, path=CACHE_SNAPSHOT_PATH):
+    """Persist the current values of keys (fresh or stale) to disk"""
+    entries = {}
+    for key in keys:
+        entry = _cache.get_entry(key)
+        if entry is not None:
+            entries[key] = {"value": entry.value, "tags": sorted(entry.tags)}
+        elif key in _last_good:
+            # Keep persisting the last good data through an outage
+            entries[key] = {"value": _last_good[key][0], "tags": []}
+    if not entries:
+        return 0
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so a crash never leaves a half-written snapshot
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"saved_at": time.time(), "entries": entries}, f, default=str)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+def load_snapshot(path=CACHE_SNAPSHOT_PATH):
+    """
+    Load a snapshot saved by save_snapshot(). Entries are loaded already
+    expired but inside a CACHE_SNAPSHOT_GRACE stale window, so they are
+    served immediately while cached_fetch refreshes them in the background.
+    Keys that are already cached (e.g. by another worker) are left alone.
+    """
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache snapshot {path}: {e}")
+        return 0
+
+    age = time.time() - snapshot.get("saved_at", 0)
+    if age > CACHE_SNAPSHOT_MAX_AGE:
+        print(f"Ignoring cache snapshot from {int(age)}s ago")
+        return 0
+
+    loaded = 0
+    for key, entry in snapshot.get("entries", {}).items():
+        if _cache.get_entry(key) is None:
+            set_in_cache(key, entry["value"], 0, CACHE_SNAPSHOT_GRACE, entry.get("tags", ()))
+            # Also usable as fallback data if PluralKit is down at startup
+            _remember(key, entry["value"], snapshot.get("saved_at"))
+            loaded += 1
+    return loaded
+
+def get_cache_stats():
+    """
+    Per-namespace cache statistics. Entry counts, sizes and ages come from
+    the backend; hit/miss counters and evictions are for this process only.
+    """
+    now = time.time()
+    namespaces = defaultdict(lambda: {
+        "hits": 0,
+        "misses": 0,
+        "stale_hits": 0,
+        "negative_hits": 0,
+        "fallback_hits": 0,
+        "evictions": 0,
+        "entries": 0,
+        "bytes": 0,
+        "keys": []
+    })
+
+    for key, size, created_at, expires_at, stale_until in _cache.describe():
+        namespace = namespaces[get_namespace(key)]
+        namespace["entries"] += 1
+        namespace["bytes"] += size
+        namespace["keys"].append({
+            "key": key,
+            "bytes": size,
+            "age_seconds": round(now - created_at, 3),
+            "expires_in_seconds": round(expires_at - now, 3),
+            "stale": now >= expires_at,
+            "hard_expires_in_seconds": round(stale_until - now, 3)
+        })
+
+    for name, counters in _stats.items():
+        namespaces[name].update(counters)
+    for name, count in _cache.evictions.items():
+        namespaces[name]["evictions"] = count
+
+    for namespace in namespaces.values():
+        lookups = namespace["hits"] + namespace["stale_hits"] + namespace["misses"]
+        namespace["hit_rate"] = (namespace["hits"] + namespace["stale_hits"]) / lookups if lookups else None
+
+    return {
+        "backend": _cache.name,
+        "entries": sum(n["entries"] for n in namespaces.values()),
+        "bytes": sum(n["bytes"] for n in namespaces.values()),
+        "max_entries": _cache.max_entries,
+        "max_bytes": _cache.max_bytes,
+        "default_ttl": _cache.default_ttl,
+        "namespace_ttls": _cache.namespace_ttls,
+        "stale_ttl": CACHE_STALE_TTL,
+        "namespaces": dict(namespaces)
+    }
+
+def flush_cache(namespace=None):
+    """Drop every entry in a namespace, or the whole cache"""
+    for key in list(_last_good):
+        if not namespace or get_namespace(key) == namespace:
+            del _last_good[key]
+    if namespace:
+        return _cache.delete_namespace(namespace)
+    count = len(_cache)
+    _cache.clear()
+    return count
@@ -0,0 +1,182 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+
+class FrontingTimeline:
+    """
+    A switch history as NumPy arrays, for per-member fronting time and
+    switch counts over any set of time ranges in a few array operations.
+
+    Switch i starts at starts[i] and lasts until the next switch (the last
+    one until end). Every member of a switch fronts for all of it, so a
+    member's time in a range is the sum of its switches' intervals clipped
+    to the range. Ranges are (lo, hi) in epoch seconds.
+    """
+
+    def __init__(self, switches, end):
+        """switches: (epoch seconds, member IDs) pairs, oldest first; end: when the last one ends"""
+        self.member_ids = []
+        member_index = {}
+        pair_switches = []
+        pair_members = []
+        starts = []
+        for i, (ts, members) in enumerate(switches):
+            starts.append(ts)
+            for member_id in members:
+                index = member_index.get(member_id)
+                if index is None:
+                    index = member_index[member_id] = len(self.member_ids)
+                    self.member_ids.append(member_id)
+                pair_switches.append(i)
+                pair_members.append(index)
+
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.append(self.starts[1:], max(end, starts[-1])) if starts else self.starts
+        # One (switch, member) pair per member of each switch
+        self._pair_switches = np.asarray(pair_switches, dtype=np.intp)
+        self._pair_members = np.asarray(pair_members, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @staticmethod
+    def _bounds(ranges):
+        bounds = np.asarray(ranges, dtype=np.float64).reshape(-1, 2)
+        return bounds[:, :1], bounds[:, 1:]
+
+    def _overlaps(self, ranges):
+        """Seconds of each switch inside each range, shape (ranges, switches)"""
+        lo, hi = self._bounds(ranges)
+        return np.clip(np.minimum(self.ends, hi) - np.maximum(self.starts, lo), 0, None)
+
+    def member_seconds(self, ranges):
+        """Fronting seconds per member in each range, shape (ranges, len(member_ids))"""
+        overlaps = self._overlaps(ranges)
+        n_ranges, n_members = overlaps.shape[0], len(self.member_ids)
+        if not n_members:
+            return np.zeros((n_ranges, 0))
+        # Scatter-add every (switch, member) pair's overlap into its member's
+        # column, for all ranges in one bincount
+        columns = (np.arange(n_ranges)[:, None] * n_members + self._pair_members).ravel()
+        weights = overlaps[:, self._pair_switches].ravel()
+        return np.bincount(columns, weights=weights, minlength=n_ranges * n_members).reshape(n_ranges, n_members)
+
+    def switch_counts(self, ranges, include_end=True):
+        """Number of switches made within each range, lo included, hi unless include_end is False"""
+        lo, hi = self._bounds(ranges)
+        side = "right" if include_end else "left"
+        return np.searchsorted(self.starts, hi[:, 0], side=side) - np.searchsorted(self.starts, lo[:, 0], side="left")
+
+    def buckets(self, lo, hi, size):
+        """
+        Fronting seconds and switch counts per fixed-size bucket of [lo, hi),
+        where lo and hi are multiples of size and bucket b covers
+        [b * size, (b + 1) * size). Returns (buckets, member indexes, seconds)
+        for every member that fronted in a bucket, and (buckets, switches)
+        for every bucket in which switches were made.
+        """
+        first = int(lo // size)
+        n_buckets = int(hi // size) - first
+        n_members = len(self.member_ids)
+
+        # Every (switch, member) pair, clipped to [lo, hi)
+        starts = np.clip(self.starts, lo, hi)[self._pair_switches]
+        ends = np.clip(self.ends, lo, hi)[self._pair_switches]
+        fronted = ends > starts
+        starts, ends, members = starts[fronted], ends[fronted], self._pair_members[fronted]
+
+        # Split each pair into one piece per bucket it touches
+        first_buckets = (starts // size).astype(np.intp)
+        pieces = np.ceil(ends / size).astype(np.intp) - first_buckets
+        pair_of_piece = np.repeat(np.arange(len(starts)), pieces)
+        piece_buckets = first_buckets[pair_of_piece] + (
+            np.arange(len(pair_of_piece)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        )
+        piece_seconds = (
+            np.minimum(ends[pair_of_piece], (piece_buckets + 1) * size)
+            - np.maximum(starts[pair_of_piece], piece_buckets * size)
+        )
+
+        # Sum the pieces per (bucket, member)
+        seconds = np.bincount(
+            (piece_buckets - first) * n_members + members[pair_of_piece],
+            weights=piece_seconds,
+            minlength=n_buckets * n_members
+        )
+        cells = np.flatnonzero(seconds > 0)
+        if n_members:
+            member_buckets = (first + cells // n_members, cells % n_members, seconds[cells])
+        else:
+            member_buckets = (cells, cells, seconds[cells])
+
+        made = self.starts[(self.starts >= lo) & (self.starts < hi)]
+        counts = np.bincount((made // size).astype(np.intp) - first, minlength=n_buckets)
+        switch_buckets = np.flatnonzero(counts)
+        return member_buckets, (first + switch_buckets, counts[switch_buckets])
+
+class BucketTotals:
+    """
+    Running totals over rolled-up buckets (see FrontingTimeline.buckets),
+    so the fronting seconds per member and the switch count of any run of
+    whole buckets take a few binary searches instead of a sum over every
+    bucket. Only the buckets in which a member fronted are kept, so memory
+    grows with the rollup rows rather than with buckets times members.
+    """
+
+    # Buckets are keyed as member index * _STRIDE + bucket, which keeps each
+    # member's buckets together and in order
+    _STRIDE = 1 << 32
+
+    def __init__(self, end, member_buckets, switch_buckets):
+        """Buckets before end, from (buckets, member IDs, seconds) and (buckets, switches)"""
+        buckets, members, seconds = member_buckets
+        self.end = end
+        self.member_ids = sorted(set(members))
+        member_index = {member_id: i for i, member_id in enumerate(self.member_ids)}
+
+        keys = np.asarray([member_index[member_id] for member_id in members], dtype=np.int64) * self._STRIDE
+        keys += np.asarray(buckets, dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        # Entry i is the total of the first i keys; a member's window is the
+        # difference of two entries within its run of keys
+        self._seconds = np.concatenate(([0.0], np.cumsum(np.asarray(seconds, dtype=np.float64)[order])))
+        self._member_keys = np.arange(len(self.member_ids), dtype=np.int64) * self._STRIDE
+
+        switch_rows, switches = switch_buckets
+        order = np.argsort(np.asarray(switch_rows, dtype=np.int64), kind="stable")
+        self._switch_buckets = np.asarray(switch_rows, dtype=np.int64)[order]
+        self._switches = np.concatenate(([0], np.cumsum(np.asarray(switches, dtype=np.int64)[order])))
+
+    def window(self, lo, hi):
+        """(seconds per member as {member ID: seconds}, switches) of buckets lo to hi (excluded)"""
+        hi = min(hi, self.end)
+        if hi <= lo:
+            return {}, 0
+        starts = np.searchsorted(self._keys, self._member_keys + lo)
+        ends = np.searchsorted(self._keys, self._member_keys + hi)
+        seconds = self._seconds[ends] - self._seconds[starts]
+        switches = self._switches[np.searchsorted(self._switch_buckets, hi)] - self._switches[np.searchsorted(self._switch_buckets, lo)]
+        return dict(zip(self.member_ids, seconds.tolist())), int(switches)
@@ -26,17 +26,19 @@ SOFTWARE.
 # IMPORTS
 # ============================================================================
 import os
+import hmac
 import shutil
 import aiofiles
 import uuid
 import json
 import asyncio
 import weakref
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Optional, Set, Dict, Any
 
-from fastapi import FastAPI, HTTPException, Request, Depends, Security, status, File, UploadFile, WebSocket, WebSocketDisconnect, Body
+from fastapi import FastAPI, HTTPException, Request, Depends, Security, status, File, UploadFile, WebSocket, WebSocketDisconnect, Body, BackgroundTasks
 from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -46,7 +48,13 @@ from jose import JWTError
 from dotenv import load_dotenv
 
 # Local imports
-from pluralkit import get_system, get_members, get_fronters, set_front, create_dynamic_cofront, MAX_FRONTERS
+from pluralkit import (
+    get_system, get_members, get_fronters, refresh_fronters, set_front,
+    create_dynamic_cofront, get_member_registry, MAX_FRONTERS
+)
+import pluralkit_client
+import avatar_proxy
+import switch_store
 from auth import router as auth_router, get_current_user, oauth2_scheme
 from subsystems import (
     get_subsystems, get_member_tags, get_members_by_subsystem, 
@@ -58,6 +66,10 @@ from models import (
     CofrontResponse, MultiSwitchRequest, MultiSwitchResponse, SubSystem, 
     MemberTag, SubSystemFilter
 )
+from cache import (
+    invalidate, get_cache_stats, flush_cache, lookup, acquire_lease,
+    save_snapshot, load_snapshot, wait_for_refreshes, track_stale_reads
+)
 from users import get_users, create_user, delete_user, initialize_admin_user, update_user, get_user_by_id
 from metrics import get_fronting_time_metrics, get_switch_frequency_metrics
 
@@ -66,7 +78,97 @@ from metrics import get_fronting_time_metrics, get_switch_frequency_metrics
 # ============================================================================
 load_dotenv()
 
-app = FastAPI()
+# Cache keys persisted across restarts so the first visitors after a deploy
+# don't wait on a cold chain of PluralKit calls
+SNAPSHOT_KEYS = ["system", "members_raw", "fronters"]
+CACHE_SNAPSHOT_INTERVAL = int(os.getenv("CACHE_SNAPSHOT_INTERVAL", 300))
+
+# How often (seconds) to poll PluralKit for switches made outside this app
+# (Discord, the PluralKit app, ...) and push them to clients; 0 disables
+FRONTERS_POLL_INTERVAL = int(os.getenv("FRONTERS_POLL_INTERVAL", 30))
+
+# Signing token of the PluralKit dispatch webhook; the webhook endpoint is
+# disabled when this isn't set
+PK_WEBHOOK_TOKEN = os.getenv("PK_WEBHOOK_TOKEN")
+
+async def warm_cache():
+    """Refresh the snapshotted resources from PluralKit and persist them"""
+    # Warm-up shouldn't hold up requests from the first visitors
+    with pluralkit_client.low_priority():
+        results = await asyncio.gather(
+            get_system(), get_members(), get_fronters(), switch_store.sync(),
+            return_exceptions=True
+        )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Cache warm-up error: {result}")
+    # Loaded snapshot data is served stale and refreshed in the background
+    await wait_for_refreshes()
+    saved = save_snapshot(SNAPSHOT_KEYS)
+    print(f"Cache warmed, saved {saved} entries to snapshot")
+
+async def backfill_switch_history():
+    """Download the older switch history without holding up requests"""
+    with pluralkit_client.low_priority():
+        await switch_store.backfill()
+
+async def snapshot_loop():
+    """Periodically persist the last good data"""
+    while True:
+        await asyncio.sleep(CACHE_SNAPSHOT_INTERVAL)
+        try:
+            save_snapshot(SNAPSHOT_KEYS)
+        except Exception as e:
+            print(f"Error saving cache snapshot: {e}")
+
+async def poll_fronters():
+    """Broadcast front changes that didn't go through our own switch endpoints"""
+    while True:
+        await asyncio.sleep(FRONTERS_POLL_INTERVAL)
+        try:
+            # With several workers sharing a cache only one of them polls
+            # PluralKit per interval; the others pick the result up from the cache
+            if acquire_lease("fronters_poll", FRONTERS_POLL_INTERVAL * 0.8):
+                with pluralkit_client.low_priority():
+                    await refresh_fronters()
+            # Broadcast what is in the cache rather than what the refresh
+            # returned: a switch made during the refresh drops its result
+            # and stores the new front, which must not be overwritten
+            # on clients by the old one
+            fronters_data = lookup("fronters", allow_stale=True).value
+            if fronters_data is not None and fronting_signature(fronters_data) != _last_fronting_signature:
+                await broadcast_fronting_update(fronters_data)
+        except Exception as e:
+            print(f"Error polling fronters: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await pluralkit_client.startup()
+    loaded = load_snapshot()
+    if loaded:
+        print(f"Loaded {loaded} cache entries from snapshot")
+    # Warm up in the background so the server starts accepting traffic right away
+    background_tasks = [
+        asyncio.create_task(warm_cache()),
+        asyncio.create_task(snapshot_loop()),
+        asyncio.create_task(backfill_switch_history())
+    ]
+    if FRONTERS_POLL_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(poll_fronters()))
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        try:
+            save_snapshot(SNAPSHOT_KEYS)
+        except Exception as e:
+            print(f"Error saving cache snapshot: {e}")
+        await pluralkit_client.shutdown()
+        await avatar_proxy.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Initialize the admin user if no users exist
 initialize_admin_user()
@@ -100,6 +202,16 @@ class FileSizeLimitMiddleware(BaseHTTPMiddleware):
         response = await call_next(request)
         return response
 
+# Marks responses built from fallback data served during a PluralKit outage
+class StaleDataMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        stale = track_stale_reads()
+        response = await call_next(request)
+        if stale:
+            response.headers["X-Data-Stale"] = ", ".join(sorted(stale))
+            response.headers["X-Data-Age"] = str(int(max(stale.values())))
+        return response
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -116,11 +228,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Data-Stale", "X-Data-Age"],
 )
 
 # Add the file size limit middleware
 app.add_middleware(FileSizeLimitMiddleware)
 
+# Add the stale data marker middleware
+app.add_middleware(StaleDataMiddleware)
+
 # Include login route
 app.include_router(auth_router)
 
@@ -337,8 +453,20 @@ async def broadcast_frontend_update(data_type: str, data: dict = None):
     }
     await manager.broadcast_json(message)
 
+# Identifies the front last sent to clients, so the poller only broadcasts real changes
+_last_fronting_signature = None
+
+def fronting_signature(fronters_data: dict):
+    """The switch ID and fronting member IDs, which change whenever the front does"""
+    return (
+        fronters_data.get("id"),
+        tuple(member.get("id") for member in fronters_data.get("members") or [])
+    )
+
 async def broadcast_fronting_update(fronters_data: dict):
     """Broadcast fronting member changes"""
+    global _last_fronting_signature
+    _last_fronting_signature = fronting_signature(fronters_data)
     await broadcast_frontend_update("fronting_update", fronters_data)
 
 async def broadcast_mental_state_update(mental_state_data: dict):
@@ -357,9 +485,8 @@ async def broadcast_cofront_update(cofront_data: dict):
 # MENTAL STATE API ENDPOINTS
 # ============================================================================
 
-@app.get("/api/mental-state")
-async def get_mental_state():
-    """Get current mental state from database"""
+def load_mental_state() -> MentalState:
+    """Read the current mental state from disk (blocking; run it in a thread)"""
     try:
         # Check if mental_state.json exists
         if os.path.exists("mental_state.json"):
@@ -383,6 +510,11 @@ async def get_mental_state():
             notes=None
         )
 
+@app.get("/api/mental-state")
+async def get_mental_state():
+    """Get current mental state from database"""
+    return await asyncio.to_thread(load_mental_state)
+
 @app.post("/api/mental-state")
 async def update_mental_state(state: MentalState, user = Depends(get_current_user)):
     """Update mental state (admin only)"""
@@ -410,31 +542,54 @@ async def update_mental_state(state: MentalState, user = Depends(get_current_use
 @app.get("/api/system")
 async def system_info():
     try:
-        # Get system data
-        system_data = await get_system()
-        
-        # Get mental state
-        mental_state_data = None
-        if os.path.exists("mental_state.json"):
-            with open("mental_state.json", "r") as f:
-                state_data = json.load(f)
-                # Convert the string back to datetime for the response
-                state_data["updated_at"] = datetime.fromisoformat(state_data["updated_at"])
-                mental_state_data = MentalState(**state_data)
-        else:
-            mental_state_data = MentalState(
-                level="safe",
-                updated_at=datetime.now(timezone.utc),
-                notes=None
-            )
-        
-        # Add mental state to system data
-        system_data["mental_state"] = mental_state_data.dict()
+        # Get system data and mental state
+        system_data, mental_state_data = await asyncio.gather(
+            get_system(),
+            asyncio.to_thread(load_mental_state)
+        )
         
-        return system_data
+        # Add mental state to (a copy of the cached) system data
+        return {**system_data, "mental_state": mental_state_data.dict()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch system info: {str(e)}")
 
+@app.get("/api/bootstrap")
+async def bootstrap():
+    """
+    Everything the front page needs in one response. The parts are fetched
+    concurrently, so it takes as long as the slowest of them; a part that
+    fails is returned as null instead of failing the whole response.
+    """
+    parts = ["system", "members", "fronters", "mental_state"]
+    results = await asyncio.gather(
+        get_system(),
+        get_members(),
+        get_fronters(),
+        asyncio.to_thread(load_mental_state),
+        return_exceptions=True
+    )
+    
+    errors = {}
+    payload = {}
+    for part, result in zip(parts, results):
+        if isinstance(result, Exception):
+            print(f"Error fetching {part} for bootstrap: {result}")
+            errors[part] = str(result)
+            payload[part] = None
+        else:
+            payload[part] = result
+    
+    if len(errors) == len(parts):
+        raise HTTPException(status_code=500, detail=f"Failed to fetch bootstrap data: {errors}")
+    
+    if payload["mental_state"] is not None:
+        payload["mental_state"] = payload["mental_state"].dict()
+        if payload["system"] is not None:
+            payload["system"] = {**payload["system"], "mental_state": payload["mental_state"]}
+    if errors:
+        payload["errors"] = errors
+    return payload
+
 @app.get("/api/members")
 async def members(
     subsystem: Optional[str] = None,
@@ -468,11 +623,13 @@ async def fronters():
 @app.get("/api/member/{member_id}")
 async def member_detail(member_id: str):
     try:
-        members = await get_members()
-        for member in members:
-            if member["id"] == member_id or member["name"].lower() == member_id.lower():
-                return member
+        registry = await get_member_registry()
+        member = registry.find(member_id)
+        if member:
+            return member
         raise HTTPException(status_code=404, detail="Member not found")
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch member details: {str(e)}")
 
@@ -555,18 +712,17 @@ async def switch_multiple_fronters(
             )
         
         # Get the members to show their names in the response
-        all_members = await get_members()
+        registry = await get_member_registry()
         switching_members = []
         
         for member_id in member_ids:
-            for member in all_members:
-                if member.get("id") == member_id:
-                    switching_members.append({
-                        "id": member.get("id"),
-                        "name": member.get("name"),
-                        "display_name": member.get("display_name", member.get("name"))
-                    })
-                    break
+            member = registry.by_id.get(member_id)
+            if member:
+                switching_members.append({
+                    "id": member.get("id"),
+                    "name": member.get("name"),
+                    "display_name": member.get("display_name", member.get("name"))
+                })
         
         # Switch the fronters
         await set_front(member_ids)
@@ -757,9 +913,8 @@ async def update_member_tag_list(
         success = update_member_tags(member_identifier, tags)
         
         if success:
-            # Clear member cache to reflect changes
-            from cache import set_in_cache
-            set_in_cache("members_raw", None, 0)
+            # Clear every member/fronter entry derived from the old tags
+            invalidate("subsystems")
             
             return {
                 "status": "success",
@@ -795,9 +950,8 @@ async def add_single_member_tag(
         success = add_member_tag(member_identifier, tag)
         
         if success:
-            # Clear member cache to reflect changes
-            from cache import set_in_cache
-            set_in_cache("members_raw", None, 0)
+            # Clear every member/fronter entry derived from the old tags
+            invalidate("subsystems")
             
             return {
                 "status": "success",
@@ -828,9 +982,8 @@ async def remove_single_member_tag(
         success = remove_member_tag(member_identifier, tag)
         
         if success:
-            # Clear member cache to reflect changes
-            from cache import set_in_cache
-            set_in_cache("members_raw", None, 0)
+            # Clear every member/fronter entry derived from the old tags
+            invalidate("subsystems")
             
             return {
                 "status": "success",
@@ -1045,6 +1198,24 @@ async def get_avatar(filename: str):
     # If not found locally, redirect to default avatar
     return RedirectResponse(url=DEFAULT_AVATAR)
 
+@app.get("/api/avatar-proxy/{key}")
+async def get_proxied_avatar(key: str):
+    """Serve a member avatar from the local avatar cache"""
+    result = await avatar_proxy.get_avatar(key)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    
+    path, content_type, url = result
+    if path is None:
+        # Couldn't download it; let the browser try the original
+        return RedirectResponse(url=url)
+    
+    return FileResponse(
+        path=path,
+        media_type=content_type,
+        headers={"Cache-Control": avatar_proxy.IMMUTABLE_CACHE_CONTROL, **avatar_proxy.SECURITY_HEADERS}
+    )
+
 # ============================================================================
 # METRICS API ENDPOINTS
 # ============================================================================
@@ -1067,6 +1238,64 @@ async def switch_frequency_metrics(days: int = 30, user = Depends(get_current_us
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch switch frequency metrics: {str(e)}")
 
+# ============================================================================
+# PLURALKIT WEBHOOK ENDPOINT
+# ============================================================================
+
+# Cache tags dropped for each PluralKit dispatch event type
+WEBHOOK_EVENT_TAGS = {
+    "UPDATE_SYSTEM": ("system",),
+    "CREATE_MEMBER": ("members",),
+    "UPDATE_MEMBER": ("members",),
+    "DELETE_MEMBER": ("members",),
+    "SUCCESSFUL_IMPORT": ("system", "members", "switches"),
+    "CREATE_SWITCH": ("fronters", "switches"),
+    "UPDATE_SWITCH": ("fronters", "switches"),
+    "DELETE_SWITCH": ("fronters", "switches"),
+    "DELETE_ALL_SWITCHES": ("fronters", "switches"),
+}
+
+async def apply_pluralkit_event(event_type: str, entity_id: Optional[str] = None):
+    """Refetch what a dispatch event changed and push it to connected clients"""
+    try:
+        if "switches" in WEBHOOK_EVENT_TAGS[event_type]:
+            await switch_store.apply_event(event_type, entity_id)
+        if "members" in WEBHOOK_EVENT_TAGS[event_type]:
+            await broadcast_member_update(await get_members())
+        # Member changes can also change how the current fronters are shown
+        if {"members", "fronters"} & set(WEBHOOK_EVENT_TAGS[event_type]):
+            await broadcast_fronting_update(await get_fronters())
+    except Exception as e:
+        print(f"Error applying PluralKit {event_type} event: {e}")
+
+@app.post("/api/pluralkit/webhook")
+async def pluralkit_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Receive PluralKit dispatch events so changes show up without waiting for the cache to expire"""
+    if not PK_WEBHOOK_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    try:
+        event = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(event, dict):
+        raise HTTPException(status_code=400, detail="Invalid event")
+
+    signing_token = event.get("signing_token")
+    if not isinstance(signing_token, str) or not hmac.compare_digest(signing_token, PK_WEBHOOK_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid signing token")
+
+    event_type = event.get("type")
+    # PING is sent when the webhook is registered, and needs a 200 to succeed
+    if event_type not in WEBHOOK_EVENT_TAGS:
+        return {"success": True}
+
+    for tag in WEBHOOK_EVENT_TAGS[event_type]:
+        invalidate(tag)
+    # Answer PluralKit right away and refetch after the response is sent
+    background_tasks.add_task(apply_pluralkit_event, event_type, event.get("id"))
+    return {"success": True}
+
 # ============================================================================
 # ADMIN UTILITY ENDPOINTS
 # ============================================================================
@@ -1086,3 +1315,38 @@ async def admin_refresh(user = Depends(get_current_user)):
         return {"success": True, "message": "Refresh broadcast sent"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to broadcast refresh: {str(e)}")
+
+@app.get("/api/admin/cache")
+async def admin_cache_stats(user = Depends(get_current_user)):
+    """Get cache statistics per key namespace (admin only)"""
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    
+    try:
+        return get_cache_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch cache stats: {str(e)}")
+
+@app.get("/api/admin/pluralkit")
+async def admin_pluralkit_status(user = Depends(get_current_user)):
+    """Get the state of the PluralKit circuit breaker (admin only)"""
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    
+    return pluralkit_client.breaker.status()
+
+@app.delete("/api/admin/cache")
+async def admin_flush_cache(namespace: Optional[str] = None, user = Depends(get_current_user)):
+    """Flush one cache namespace, or the whole cache if none is given (admin only)"""
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    
+    try:
+        flushed = flush_cache(namespace)
+        return {
+            "success": True,
+            "message": f"Flushed {flushed} cache entries" + (f" from '{namespace}'" if namespace else ""),
+            "flushed": flushed
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to flush cache: {str(e)}")
@@ -22,21 +22,12 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import httpx
 import os
-from dotenv import load_dotenv
-from cache import get_from_cache, set_in_cache
-from subsystems import enrich_members_with_tags, filter_members_by_subsystem
-
-load_dotenv()
-
-BASE_URL = "https://api.pluralkit.me/v2"
-TOKEN = os.getenv("SYSTEM_TOKEN")
-CACHE_TTL = int(os.getenv("CACHE_TTL", 30))
-
-HEADERS = {
-    "Authorization": TOKEN
-}
+import uuid
+from cache import cached_fetch, refresh_cached, set_in_cache, invalidate, CACHE_STALE_TTL
+from pluralkit_client import request, get_json, get_json_conditional
+from subsystems import enrich_members_with_tags, get_subsystems
+from avatar_proxy import proxy_member_avatars
 
 # Cofront/fusion member definitions - up to 5 members
 # Values can be lists of 2-5 member names
@@ -46,6 +37,10 @@ COFRONTS = {
     "saja": ["baby", "jinu", "mystery", "romance", "abby"]
 }
 
+# Processed member lists only change when the raw member list or the tag
+# assignments change, and both invalidate them, so they can live long
+PROCESSED_MEMBERS_TTL = int(os.getenv("PROCESSED_MEMBERS_TTL", 3600))
+
 # Max number of members allowed in a cofront (enforced in set_front function)
 MAX_FRONTERS = 6
 
@@ -57,38 +52,127 @@ SPECIAL_DISPLAY_NAMES = {
 }
 
 async def get_system():
-    cache_key = "system"
-    if (cached := get_from_cache(cache_key)):
-        return cached
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{BASE_URL}/systems/@me", headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        set_in_cache(cache_key, data, CACHE_TTL)
-        return data
+    return await cached_fetch("system", _fetch_system, tags=("system",))
+
+async def _fetch_system():
+    data, _ = await get_json_conditional("/systems/@me")
+    return data
+
+class MemberRegistry:
+    """
+    Dict indexes over a member list, so lookups by ID or name don't scan it.
+    When several members share a key, the first one in the list wins, the
+    same as a linear scan would.
+    """
+
+    def __init__(self, members):
+        self.members = members
+        self.by_id = {}
+        self.by_name = {}
+        self.by_lower_name = {}
+        for member in members:
+            member_id = member.get("id")
+            if member_id:
+                self.by_id.setdefault(member_id, member)
+            # Cofront and special members also answer to their original name
+            for name in (member.get("name"), member.get("original_name")):
+                if name:
+                    self.by_name.setdefault(name, member)
+                    self.by_lower_name.setdefault(name.lower(), member)
+
+    def find(self, identifier):
+        """Find a member by ID, or by name ignoring case"""
+        if not identifier:
+            return None
+        return self.by_id.get(identifier) or self.by_lower_name.get(identifier.lower())
+
+    def __len__(self):
+        return len(self.members)
+
+# Registries for the most recently seen member lists, keyed by snapshot
+# version or list identity (the list is kept referenced so its id can't be reused)
+_registries = {}
+_MAX_REGISTRIES = 8
+
+def get_registry(members, version=None) -> MemberRegistry:
+    """Get the registry for a member list, building it only once per list or version"""
+    key = version or id(members)
+    cached = _registries.get(key)
+    if cached is not None and (version or cached[0] is members):
+        return cached[1]
+    registry = MemberRegistry(members)
+    if len(_registries) >= _MAX_REGISTRIES:
+        _registries.pop(next(iter(_registries)))
+    _registries[key] = (members, registry)
+    return registry
+
+async def get_member_registry() -> MemberRegistry:
+    """Registry over the full processed member list"""
+    snapshot = await get_processed_members()
+    return get_registry(snapshot["members"], snapshot["version"])
 
 async def get_member_by_name(members_data, name):
     """Helper function to find a member by name"""
-    for member in members_data:
-        if member.get("name") == name:
-            return member
-    return None
+    return get_registry(members_data).by_name.get(name)
 
 async def get_members(subsystem_filter: str = None, include_untagged: bool = True):
-    cache_key = f"members_{subsystem_filter}_{include_untagged}"
-    if (cached := get_from_cache(cache_key)):
-        return cached
-    
-    # First get all members from PluralKit
-    base_cache_key = "members_raw"
-    if not (cached_raw := get_from_cache(base_cache_key)):
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(f"{BASE_URL}/systems/@me/members", headers=HEADERS)
-            resp.raise_for_status()
-            cached_raw = resp.json()
-            set_in_cache(base_cache_key, cached_raw, CACHE_TTL)
-    
-    data = cached_raw
+    snapshot = await get_processed_members()
+    if not subsystem_filter:
+        return snapshot["members"]
+    return _subsystem_view(snapshot, subsystem_filter, include_untagged)
+
+async def get_processed_members():
+    """
+    Get the versioned snapshot of processed members ({"version", "members"}).
+    It is built once per raw member list and tag assignment, and every
+    sub-system filter is a view over it.
+    """
+    # Revalidate the raw list first; if it changed, the snapshot below is dropped
+    await get_members_raw()
+    return await cached_fetch(
+        "members_processed",
+        _build_processed_members,
+        ttl=PROCESSED_MEMBERS_TTL,
+        tags=("members", "member_data", "subsystems")
+    )
+
+# Sub-system views of the current processed snapshot, keyed by (filter, include_untagged).
+# Only defined sub-system labels get a stored view; the filter comes from
+# clients, so anything else is computed per request rather than kept.
+_views = {"version": None, "labels": set(), "views": {}}
+
+def _subsystem_view(snapshot, subsystem_filter, include_untagged):
+    """Members matching a sub-system filter, computed once per snapshot version"""
+    if _views["version"] != snapshot["version"]:
+        _views["version"] = snapshot["version"]
+        _views["labels"] = {subsystem.label for subsystem in get_subsystems()}
+        _views["views"] = {}
+    key = (subsystem_filter, include_untagged)
+    view = _views["views"].get(key)
+    if view is None:
+        # Members are already enriched with their tags, so no tag lookups are needed here
+        view = [
+            member for member in snapshot["members"]
+            if subsystem_filter in member["tags"] or (include_untagged and not member["tags"])
+        ]
+        if subsystem_filter in _views["labels"]:
+            _views["views"][key] = view
+    return view
+
+async def get_members_raw():
+    """Get the unprocessed member list from PluralKit"""
+    return await cached_fetch("members_raw", _fetch_members_raw, tags=("members",))
+
+async def _fetch_members_raw():
+    data, changed = await get_json_conditional("/systems/@me/members")
+    if changed:
+        # Everything built from the previous member list is out of date
+        invalidate("member_data")
+    return data
+
+async def _build_processed_members():
+    """Process the raw member list into display-ready members"""
+    data = await get_members_raw()
     
     # Process cofront members and special members
     processed_members = []
@@ -148,54 +232,58 @@ async def get_members(subsystem_filter: str = None, include_untagged: bool = Tru
     # Enrich all members with tag information
     processed_members = enrich_members_with_tags(processed_members)
     
-    # Apply sub-system filtering if requested
-    if subsystem_filter:
-        processed_members = filter_members_by_subsystem(
-            processed_members, 
-            subsystem_filter, 
-            include_untagged
-        )
+    # Serve avatars through our own proxy instead of the remote CDNs
+    processed_members = proxy_member_avatars(processed_members)
     
-    set_in_cache(cache_key, processed_members, CACHE_TTL)
-    return processed_members
+    return {
+        "version": uuid.uuid4().hex,
+        "members": processed_members
+    }
+
+# Fronters embed processed member data, so they depend on members and tags too
+FRONTERS_TAGS = ("fronters", "members", "member_data", "subsystems")
+
+# The member registry is resolved before fetching fronters: revalidating the
+# member list can invalidate "member_data", and doing that inside the fetch
+# would make the cache drop the fronters it just fetched
 
 async def get_fronters():
-    cache_key = "fronters"
-    if (cached := get_from_cache(cache_key)):
-        return cached
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{BASE_URL}/systems/@me/fronters", headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
+    registry = await get_member_registry()
+    return await cached_fetch("fronters", lambda: _fetch_fronters(registry), tags=FRONTERS_TAGS)
+
+async def refresh_fronters():
+    """Fetch the current fronters from PluralKit now, bypassing the cache"""
+    registry = await get_member_registry()
+    return await refresh_cached("fronters", lambda: _fetch_fronters(registry), tags=FRONTERS_TAGS)
+
+async def _fetch_fronters(registry):
+    data = await get_json("/systems/@me/fronters")
+    return await _process_fronters(data, registry)
+
+async def _process_fronters(data, registry=None):
+    """Swap the raw members of a fronters/switch object for our processed ones"""
+    # Process special members and cofronts in fronters
+    if "members" in data:
+        # Get all members for reference (without filtering)
+        if registry is None:
+            registry = await get_member_registry()
         
-        # Process special members and cofronts in fronters
-        if "members" in data:
-            # Get all members for reference (without filtering)
-            all_members = await get_members()
+        processed_fronters = []
+        for member in data["members"]:
+            # Find the processed member data from our get_members function
+            processed_member = registry.by_id.get(member.get("id"))
             
-            processed_fronters = []
-            for member in data["members"]:
-                member_name = member.get("name")
-                
-                # Find the processed member data from our get_members function
-                processed_member = None
-                for m in all_members:
-                    if m.get("id") == member.get("id"):
-                        processed_member = m
-                        break
-                
-                if processed_member:
-                    # Use the processed member data (which includes cofront, special display name, and tag handling)
-                    processed_fronters.append(processed_member)
-                else:
-                    # Fallback to original member data but still enrich with tags
-                    enriched_member = enrich_members_with_tags([member])[0]
-                    processed_fronters.append(enriched_member)
-            
-            data["members"] = processed_fronters
+            if processed_member:
+                # Use the processed member data (which includes cofront, special display name, and tag handling)
+                processed_fronters.append(processed_member)
+            else:
+                # Fallback to original member data but still enrich with tags
+                enriched_member = proxy_member_avatars(enrich_members_with_tags([member]))[0]
+                processed_fronters.append(enriched_member)
         
-        set_in_cache(cache_key, data, CACHE_TTL)
-        return data
+        data["members"] = processed_fronters
+    
+    return data
 
 async def set_front(member_ids):
     """
@@ -206,21 +294,32 @@ async def set_front(member_ids):
     if len(member_ids) > MAX_FRONTERS:
         raise ValueError(f"Cannot have more than {MAX_FRONTERS} members fronting at once")
     
-    # Clear fronters cache since we're updating it
-    cache_key = "fronters"
-    set_in_cache(cache_key, None, 0)  # Invalidate cache
+    # Clear fronters cache since we're updating it (this also stops a fetch
+    # that is already in flight from caching the old front)
+    invalidate("fronters")
+    invalidate("switches")
     
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{BASE_URL}/systems/@me/switches",
-            headers=HEADERS,
-            json={"members": member_ids}
-        )
-        if resp.status_code not in (200, 204):
-            raise Exception(f"Failed to set front: {resp.status_code} - {resp.text}")
-
-        # If there's a response body, return it, otherwise return None
-        return resp.json() if resp.content else None
+    resp = await request("POST", "/systems/@me/switches", json={"members": member_ids})
+    if resp.status_code not in (200, 204):
+        raise Exception(f"Failed to set front: {resp.status_code} - {resp.text}")
+
+    # If there's a response body, return it, otherwise return None
+    result = resp.json() if resp.content else None
+
+    # The new switch (with full member objects) is the new fronters object, so
+    # cache it directly instead of fetching /fronters again right after
+    if isinstance(result, dict) and "members" in result:
+        fronters_data = await _process_fronters({
+            "id": result.get("id"),
+            "timestamp": result.get("timestamp"),
+            "members": list(result["members"])
+        }, await get_member_registry())
+        # A fetch that started during the POST may have read the old front,
+        # invalidate again so it can't overwrite the new one
+        invalidate("fronters")
+        set_in_cache("fronters", fronters_data, stale_ttl=CACHE_STALE_TTL, tags=FRONTERS_TAGS)
+
+    return result
 
 async def create_dynamic_cofront(member_ids, name=None):
     """
@@ -234,15 +333,14 @@ async def create_dynamic_cofront(member_ids, name=None):
         raise ValueError(f"Cofronts must have between 2 and {MAX_FRONTERS} members")
     
     # Get all members for reference (without filtering)
-    all_members = await get_members()
+    registry = await get_member_registry()
     
     # Find the members by their IDs
     component_members = []
     for member_id in member_ids:
-        for member in all_members:
-            if member.get("id") == member_id:
-                component_members.append(member)
-                break
+        member = registry.by_id.get(member_id)
+        if member:
+            component_members.append(member)
     
     # Verify we found all members
     if len(component_members) != len(member_ids):
@@ -0,0 +1,369 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import hashlib
+import httpx
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+from cache import is_background_refresh
+
+load_dotenv()
+
+# Overridable to point the backend at a local stand-in (see tools/fake_pluralkit.py)
+BASE_URL = os.getenv("PLURALKIT_API_URL", "https://api.pluralkit.me/v2").rstrip("/")
+TOKEN = os.getenv("SYSTEM_TOKEN")
+
+HEADERS = {
+    "Authorization": TOKEN
+}
+
+def _env_flag(name, default):
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+# Connection pool settings for the shared PluralKit client
+PK_HTTP2 = _env_flag("PK_HTTP2", "true")
+PK_MAX_CONNECTIONS = int(os.getenv("PK_MAX_CONNECTIONS", 20))
+PK_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PK_MAX_KEEPALIVE_CONNECTIONS", 10))
+PK_KEEPALIVE_EXPIRY = float(os.getenv("PK_KEEPALIVE_EXPIRY", 60))
+PK_TIMEOUT = float(os.getenv("PK_TIMEOUT", 10))
+PK_CONNECT_TIMEOUT = float(os.getenv("PK_CONNECT_TIMEOUT", 5))
+
+# Client-side rate limits, matching PluralKit's published per-token limits
+# (10/s for reads, 3/s for writes) so bursts are smoothed out locally
+# instead of turning into 429s upstream
+PK_READ_RATE = float(os.getenv("PK_READ_RATE", 10))
+PK_READ_BURST = int(os.getenv("PK_READ_BURST", 10))
+PK_WRITE_RATE = float(os.getenv("PK_WRITE_RATE", 3))
+PK_WRITE_BURST = int(os.getenv("PK_WRITE_BURST", 3))
+
+# Retries for rate-limited (429) and failed requests
+PK_MAX_RETRIES = int(os.getenv("PK_MAX_RETRIES", 3))
+PK_RETRY_BASE_DELAY = float(os.getenv("PK_RETRY_BASE_DELAY", 0.5))
+PK_MAX_RETRY_DELAY = float(os.getenv("PK_MAX_RETRY_DELAY", 10))
+
+# Circuit breaker: after this many failed calls in a row (timeouts,
+# connection errors, 5xx) PluralKit isn't called at all for the cooldown,
+# then one trial call decides whether to resume (0 disables the breaker)
+PK_BREAKER_THRESHOLD = int(os.getenv("PK_BREAKER_THRESHOLD", 5))
+PK_BREAKER_COOLDOWN = float(os.getenv("PK_BREAKER_COOLDOWN", 30))
+
+# Priority lanes, lower numbers go first
+PRIORITY_HIGH = 0     # writes such as set_front
+PRIORITY_NORMAL = 1   # reads a visitor is waiting on
+PRIORITY_LOW = 2      # background refreshes, warm-up, polling
+
+_priority = ContextVar("pluralkit_priority", default=None)
+
+@contextmanager
+def low_priority():
+    """Run PluralKit calls made in this block (and tasks it spawns) in the low-priority lane"""
+    token = _priority.set(PRIORITY_LOW)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def _lane_for(method):
+    if method.upper() != "GET":
+        return PRIORITY_HIGH
+    priority = _priority.get()
+    if priority is not None:
+        return priority
+    return PRIORITY_LOW if is_background_refresh() else PRIORITY_NORMAL
+
+class TokenBucket:
+    """
+    Token bucket with priority lanes. A waiter only takes a token when no
+    waiter in a higher-priority lane is queued, so background work never
+    delays requests a visitor is waiting on.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiting = {}
+
+    def block_for(self, seconds):
+        """Stop handing out tokens for a while, e.g. after a 429"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _higher_priority_waiting(self, priority):
+        return any(count for lane, count in self._waiting.items() if lane < priority)
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        self._waiting[priority] = self._waiting.get(priority, 0) + 1
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                if self._tokens >= 1 and not self._higher_priority_waiting(priority):
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0
+                # Re-check at least every few ms so higher lanes are noticed promptly
+                await asyncio.sleep(max(wait, 0.005))
+        finally:
+            self._waiting[priority] -= 1
+
+_read_bucket = TokenBucket(PK_READ_RATE, PK_READ_BURST)
+_write_bucket = TokenBucket(PK_WRITE_RATE, PK_WRITE_BURST)
+
+class PluralKitUnavailable(Exception):
+    """Raised instead of calling PluralKit while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Closed: calls go through, consecutive failures are counted.
+    Open: calls fail immediately with PluralKitUnavailable until the
+    cooldown has passed.
+    Half-open: a single trial call goes through; success closes the
+    circuit, failure opens it for another cooldown.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+
+    def before_request(self):
+        if self.threshold <= 0:
+            return
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            remaining = self._opened_at + self.cooldown - now
+            if remaining > 0:
+                raise PluralKitUnavailable(f"PluralKit circuit open, next attempt in {remaining:.0f}s")
+            self.state = self.HALF_OPEN
+            self._trial_started = None
+        if self.state == self.HALF_OPEN:
+            # A trial that never reported back (e.g. was cancelled) doesn't block forever
+            if self._trial_started is not None and now - self._trial_started < PK_TIMEOUT:
+                raise PluralKitUnavailable("PluralKit circuit half-open, waiting on a trial request")
+            self._trial_started = now
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            print("PluralKit circuit closed, requests resumed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.threshold <= 0:
+            return
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                print(f"PluralKit circuit open after {self.failures} failures, pausing for {self.cooldown:.0f}s")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._trial_started = None
+
+    def status(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in_seconds": (
+                max(0.0, round(self._opened_at + self.cooldown - time.monotonic(), 3))
+                if self.state == self.OPEN else None
+            )
+        }
+
+breaker = CircuitBreaker(PK_BREAKER_THRESHOLD, PK_BREAKER_COOLDOWN)
+
+def _retry_delay(resp, attempt):
+    """Delay before the next attempt, honouring Retry-After when PluralKit sends it"""
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), PK_MAX_RETRY_DELAY)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after).timestamp()
+                    return min(max(retry_at - time.time(), 0), PK_MAX_RETRY_DELAY)
+                except (TypeError, ValueError):
+                    pass
+        try:
+            # PluralKit also reports retry_after (in milliseconds) in 429 bodies
+            retry_after_ms = resp.json().get("retry_after")
+            if retry_after_ms is not None:
+                return min(float(retry_after_ms) / 1000, PK_MAX_RETRY_DELAY)
+        except (ValueError, AttributeError):
+            pass
+    # Exponential backoff with jitter so retries from many requests don't line up
+    delay = min(PK_RETRY_BASE_DELAY * (2 ** attempt), PK_MAX_RETRY_DELAY)
+    return random.uniform(delay / 2, delay)
+
+_client = None
+
+def _create_client():
+    return httpx.AsyncClient(
+        base_url=BASE_URL,
+        headers=HEADERS,
+        http2=PK_HTTP2,
+        limits=httpx.Limits(
+            max_connections=PK_MAX_CONNECTIONS,
+            max_keepalive_connections=PK_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=PK_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(PK_TIMEOUT, connect=PK_CONNECT_TIMEOUT)
+    )
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Shared client for every PluralKit call, so connections (and their TLS
+    sessions) are kept alive and reused instead of set up per request.
+    Created on first use if the app lifespan hasn't started it yet.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+async def startup():
+    """Open the shared client (called from the app lifespan)"""
+    get_client()
+
+async def shutdown():
+    """Close the shared client and its pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def request(method: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Send a request to the PluralKit API, path being relative to BASE_URL.
+    Requests are rate limited client-side and retried with backoff on 429s
+    (and, for reads, on 5xx responses and connection errors). Raises
+    PluralKitUnavailable without calling PluralKit while the circuit
+    breaker is open.
+    """
+    is_read = method.upper() == "GET"
+    bucket = _read_bucket if is_read else _write_bucket
+    lane = _lane_for(method)
+
+    for attempt in range(PK_MAX_RETRIES + 1):
+        breaker.before_request()
+        await bucket.acquire(lane)
+        try:
+            resp = await get_client().request(method, path, **kwargs)
+        except httpx.TransportError:
+            breaker.record_failure()
+            # Only reads are safe to resend when we don't know if the request arrived
+            if not is_read or attempt == PK_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_retry_delay(None, attempt))
+            continue
+
+        if resp.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        retryable = resp.status_code == 429 or (is_read and resp.status_code >= 500)
+        if not retryable or attempt == PK_MAX_RETRIES:
+            return resp
+
+        delay = _retry_delay(resp, attempt)
+        if resp.status_code == 429:
+            print(f"PluralKit rate limited {method} {path}, retrying in {delay:.2f}s")
+            # Hold back every request sharing this limit, not just this one
+            bucket.block_for(delay)
+        else:
+            await asyncio.sleep(delay)
+    return resp
+
+async def get_json(path: str, **kwargs):
+    """GET a PluralKit endpoint and return its decoded JSON body"""
+    resp = await request("GET", path, **kwargs)
+    resp.raise_for_status()
+    return resp.json()
+
+# Validators (ETag / Last-Modified), body digest and parsed body of the
+# last successful conditional GET, keyed by path and query parameters
+_validators = {}
+
+async def get_json_conditional(path: str, params=None):
+    """
+    GET a PluralKit endpoint with If-None-Match / If-Modified-Since from the
+    previous response. Returns (data, changed); on a 304, or a 200 with a
+    byte-identical body, the previously parsed data is returned unchanged
+    so callers can skip re-processing it.
+    """
+    key = (path, tuple(sorted((params or {}).items())))
+    previous = _validators.get(key)
+    headers = {}
+    if previous:
+        if previous["etag"]:
+            headers["If-None-Match"] = previous["etag"]
+        if previous["last_modified"]:
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    resp = await request("GET", path, params=params, headers=headers)
+    if resp.status_code == 304 and previous:
+        return previous["data"], False
+    resp.raise_for_status()
+
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    digest = hashlib.sha256(resp.content).hexdigest()
+    if previous and previous["digest"] == digest:
+        previous["etag"] = etag
+        previous["last_modified"] = last_modified
+        return previous["data"], False
+
+    data = resp.json()
+    _validators[key] = {
+        "etag": etag,
+        "last_modified": last_modified,
+        "digest": digest,
+        "data": data
+    }
+    return data, True
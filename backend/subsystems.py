@@ -92,9 +92,10 @@ def save_member_tags(member_tags: Dict[str, List[str]]):
     with open(MEMBER_TAGS_FILE, "w") as f:
         json.dump(member_tags, f, indent=2)
 
-def get_member_tags_by_id(member_id: str, member_name: str) -> List[str]:
-    """Get tags for a specific member by ID or name"""
-    member_tags = get_member_tags()
+def get_member_tags_by_id(member_id: str, member_name: str, member_tags: Optional[Dict[str, List[str]]] = None) -> List[str]:
+    """Get tags for a specific member by ID or name, optionally from already-loaded tag assignments"""
+    if member_tags is None:
+        member_tags = get_member_tags()
     
     # First try by member name
     if member_name in member_tags:
@@ -149,7 +150,7 @@ def filter_members_by_subsystem(members: List[Dict], subsystem_filter: Optional[
         member_id = member.get("id", "")
         
         # Get tags for this member
-        tags = get_member_tags_by_id(member_id, member_name)
+        tags = get_member_tags_by_id(member_id, member_name, member_tags)
         
         # Check if member should be included
         if subsystem_filter in tags:
@@ -179,7 +180,7 @@ def get_members_by_subsystem(members: List[Dict]) -> Dict[str, List[Dict]]:
         member_id = member.get("id", "")
         
         # Get tags for this member
-        tags = get_member_tags_by_id(member_id, member_name)
+        tags = get_member_tags_by_id(member_id, member_name, member_tags)
         member_with_tags = {**member, "tags": tags}
         
         if not tags:
@@ -199,6 +200,7 @@ def get_members_by_subsystem(members: List[Dict]) -> Dict[str, List[Dict]]:
 
 def enrich_members_with_tags(members: List[Dict]) -> List[Dict]:
     """Add tag information to all members"""
+    member_tags = get_member_tags()
     enriched_members = []
     
     for member in members:
@@ -206,7 +208,7 @@ def enrich_members_with_tags(members: List[Dict]) -> List[Dict]:
         member_id = member.get("id", "")
         
         # Get tags for this member
-        tags = get_member_tags_by_id(member_id, member_name)
+        tags = get_member_tags_by_id(member_id, member_name, member_tags)
         
         # Add tags to member data
         member_with_tags = {**member, "tags": tags}
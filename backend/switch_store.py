@@ -0,0 +1,504 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from cache import cached_fetch
+from fronting_engine import FrontingTimeline, BucketTotals
+from pluralkit_client import get_json, low_priority
+
+load_dotenv()
+
+# Local copy of the system's full switch history, so metrics don't need
+# PluralKit (or its page limits) to look back further than a few switches
+SWITCH_DB_PATH = os.getenv("SWITCH_DB_PATH", "data/switches.db")
+# Minimum time (seconds) between syncs with PluralKit; switch webhooks and
+# switches made through this app trigger a sync sooner
+SWITCH_SYNC_INTERVAL = int(os.getenv("SWITCH_SYNC_INTERVAL", 60))
+
+# PluralKit's maximum page size for /switches
+PAGE_SIZE = 100
+
+def _epoch(timestamp):
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+# Fronting time and switch counts are rolled up per hour, so metrics only
+# need to look at the raw switches for the partial hours at either end
+ROLLUP_BUCKET = 3600
+# Hours rolled up per pass, which bounds memory when the whole history is
+# rolled up for the first time
+ROLLUP_CHUNK = 30 * 24
+
+class SwitchStore:
+    """
+    Switches in a SQLite database in WAL mode, shared by every worker.
+    Switches are stored as PluralKit returns them (id, timestamp, member
+    IDs) plus the timestamp as epoch seconds for range queries.
+
+    hourly_fronting and hourly_switches hold per-member fronting seconds
+    and switch counts for every hour (epoch seconds // ROLLUP_BUCKET)
+    before the rollup_until hour in sync_state. A change to a switch at
+    time t only affects the hours from t on, so it moves rollup_until
+    back to t's hour and refresh_rollups() recomputes just those. Each
+    process reads the rollups into running totals, reloaded whenever
+    rollup_version changes.
+
+    Rollups are computed and read on a second connection, so the writes
+    made while syncing never wait for them.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS switches (
+            id TEXT PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            ts REAL NOT NULL,
+            members TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS switches_ts ON switches(ts);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS hourly_fronting (
+            hour INTEGER NOT NULL,
+            member TEXT NOT NULL,
+            seconds REAL NOT NULL,
+            PRIMARY KEY (hour, member)
+        );
+        CREATE TABLE IF NOT EXISTS hourly_switches (
+            hour INTEGER PRIMARY KEY,
+            switches INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path=SWITCH_DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._read_lock = threading.Lock()
+        self._read_conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        # (rollup_version, BucketTotals) last read by this process, guarded by _read_lock
+        self._rollups = (None, None)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @contextmanager
+    def _read_snapshot(self):
+        """A consistent view of the database on the read connection"""
+        with self._read_lock:
+            self._read_conn.execute("BEGIN DEFERRED")
+            try:
+                yield self._read_conn
+            finally:
+                self._read_conn.execute("COMMIT")
+
+    def get_state(self, key):
+        with self._lock:
+            return self._state(self._conn, key)
+
+    def set_state(self, key, value):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+    def _stored(self, conn, switch_ids):
+        """id -> (ts, members) of the given switches that are stored"""
+        stored = {}
+        switch_ids = list(switch_ids)
+        for i in range(0, len(switch_ids), PAGE_SIZE):
+            chunk = switch_ids[i:i + PAGE_SIZE]
+            rows = conn.execute(
+                f"SELECT id, ts, members FROM switches WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            stored.update((row[0], (row[1], row[2])) for row in rows)
+        return stored
+
+    def _invalidate_rollups(self, conn, since_ts):
+        """The switches changed, so the rollups from the hour of since_ts on no longer match them"""
+        until = self._rollup_until(conn)
+        hour = int(since_ts // ROLLUP_BUCKET)
+        if until is not None and hour < until:
+            conn.execute("UPDATE sync_state SET value = ? WHERE key = 'rollup_until'", (str(hour),))
+        self._new_version(conn, "switches_version")
+
+    @staticmethod
+    def _state(conn, key):
+        row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def _rollup_until(cls, conn):
+        until = cls._state(conn, "rollup_until")
+        return int(until) if until is not None else None
+
+    @staticmethod
+    def _new_version(conn, key):
+        # Random rather than a counter, so a version is never seen twice (even after clear())
+        conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, uuid.uuid4().hex))
+
+    def _rollup_totals(self, conn):
+        """Running totals of the rollups, read again only after they changed"""
+        version = self._state(conn, "rollup_version")
+        if self._rollups[0] != version or self._rollups[1] is None:
+            until = self._rollup_until(conn) or 0
+            member_rows = conn.execute(
+                "SELECT hour, member, seconds FROM hourly_fronting WHERE hour < ?", (until,)
+            ).fetchall()
+            switch_rows = conn.execute(
+                "SELECT hour, switches FROM hourly_switches WHERE hour < ?", (until,)
+            ).fetchall()
+            self._rollups = (version, BucketTotals(
+                until,
+                tuple(zip(*member_rows)) or ((), (), ()),
+                tuple(zip(*switch_rows)) or ((), ())
+            ))
+        return self._rollups[1]
+
+    def add(self, switches):
+        """Insert or update switches, returning how many weren't stored yet"""
+        rows = {
+            switch["id"]: (switch["id"], switch["timestamp"], _epoch(switch["timestamp"]), json.dumps(switch["members"]))
+            for switch in switches
+        }
+        with self._transaction() as conn:
+            stored = self._stored(conn, rows)
+            # Re-reading unchanged switches (every sync re-reads the newest
+            # page) leaves the rollups alone
+            changed = []
+            for switch_id, row in rows.items():
+                old = stored.get(switch_id)
+                if old is None:
+                    changed.append(row[2])
+                elif old != (row[2], row[3]):
+                    changed.extend((old[0], row[2]))
+            conn.executemany(
+                "INSERT OR REPLACE INTO switches (id, timestamp, ts, members) VALUES (?, ?, ?, ?)",
+                list(rows.values())
+            )
+            if changed:
+                self._invalidate_rollups(conn, min(changed))
+        return len(rows) - len(stored)
+
+    def delete(self, switch_ids):
+        with self._transaction() as conn:
+            stored = self._stored(conn, switch_ids)
+            conn.executemany("DELETE FROM switches WHERE id = ?", [(i,) for i in stored])
+            if stored:
+                self._invalidate_rollups(conn, min(ts for ts, _ in stored.values()))
+
+    def replace_newest(self, switches, since_ts):
+        """Make the stored switches newer than since_ts exactly switches"""
+        keep = {switch["id"] for switch in switches}
+        with self._lock:
+            stored = self._conn.execute(
+                "SELECT id FROM switches WHERE ts > ?", (since_ts,)
+            ).fetchall()
+        removed = [row[0] for row in stored if row[0] not in keep]
+        if removed:
+            self.delete(removed)
+        return self.add(switches)
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM switches")
+            conn.execute("DELETE FROM sync_state")
+            conn.execute("DELETE FROM hourly_fronting")
+            conn.execute("DELETE FROM hourly_switches")
+            self._new_version(conn, "switches_version")
+            self._new_version(conn, "rollup_version")
+
+    def latest(self):
+        """The newest stored switch, with its epoch seconds as "ts", or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, timestamp, members, ts FROM switches ORDER BY ts DESC LIMIT 1"
+            ).fetchone()
+        return {**self._to_switch(row), "ts": row[3]} if row else None
+
+    def oldest(self):
+        """The oldest stored switch, with its epoch seconds as "ts", or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, timestamp, members, ts FROM switches ORDER BY ts ASC LIMIT 1"
+            ).fetchone()
+        return {**self._to_switch(row), "ts": row[3]} if row else None
+
+    def timeline(self, since_ts, until_ts=math.inf):
+        """
+        (epoch seconds, member IDs) of every switch from the one that was
+        active at since_ts up to until_ts (included), oldest first
+        """
+        with self._lock:
+            return self._timeline(self._conn, since_ts, until_ts)
+
+    @staticmethod
+    def _timeline(conn, since_ts, until_ts):
+        rows = conn.execute(
+            """
+            SELECT ts, members FROM switches
+            WHERE ts >= (SELECT COALESCE(MAX(ts), ?) FROM switches WHERE ts <= ?) AND ts <= ?
+            ORDER BY ts ASC
+            """,
+            (since_ts, since_ts, until_ts)
+        ).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def refresh_rollups(self, now_ts):
+        """Roll up every complete hour before now_ts that isn't rolled up (any more)"""
+        end = int(now_ts // ROLLUP_BUCKET)
+        # Computed from a snapshot, without holding up writes to the switches
+        with self._read_snapshot() as conn:
+            until = self._rollup_until(conn)
+            if until is not None and until >= end:
+                return
+            version = self._state(conn, "switches_version")
+            start = until
+            if start is None:
+                oldest = conn.execute("SELECT MIN(ts) FROM switches").fetchone()[0]
+                start = int(oldest // ROLLUP_BUCKET) if oldest is not None else end
+            member_rows = []
+            switch_rows = []
+            for chunk_start in range(start, end, ROLLUP_CHUNK):
+                lo = chunk_start * ROLLUP_BUCKET
+                hi = min(chunk_start + ROLLUP_CHUNK, end) * ROLLUP_BUCKET
+                timeline = FrontingTimeline(self._timeline(conn, lo, hi), hi)
+                (hours, members, seconds), (switch_hours, switches) = timeline.buckets(lo, hi, ROLLUP_BUCKET)
+                member_rows.extend(zip(hours.tolist(), [timeline.member_ids[i] for i in members], seconds.tolist()))
+                switch_rows.extend(zip(switch_hours.tolist(), switches.tolist()))
+
+        with self._transaction() as conn:
+            if self._rollup_until(conn) != until or self._state(conn, "switches_version") != version:
+                # The switches changed (or another worker rolled up) meanwhile; the next call starts over
+                return
+            conn.execute("DELETE FROM hourly_fronting WHERE hour >= ?", (start,))
+            conn.execute("DELETE FROM hourly_switches WHERE hour >= ?", (start,))
+            conn.executemany("INSERT INTO hourly_fronting (hour, member, seconds) VALUES (?, ?, ?)", member_rows)
+            conn.executemany("INSERT INTO hourly_switches (hour, switches) VALUES (?, ?)", switch_rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('rollup_until', ?)", (str(max(start, end)),)
+            )
+            self._new_version(conn, "rollup_version")
+
+    def _totals(self, conn, rollups, until, lo, hi):
+        member_seconds = {}
+        switches = 0
+        first_hour = math.ceil(lo / ROLLUP_BUCKET)
+        last_hour = min(int(hi // ROLLUP_BUCKET), until)
+        if last_hour > first_hour:
+            member_seconds, switches = rollups.window(first_hour, last_hour)
+            edges = [(lo, first_hour * ROLLUP_BUCKET, False), (last_hour * ROLLUP_BUCKET, hi, True)]
+        else:
+            edges = [(lo, hi, True)]
+
+        for edge_lo, edge_hi, include_end in edges:
+            timeline = FrontingTimeline(self._timeline(conn, edge_lo, edge_hi), edge_hi)
+            for member_id, seconds in zip(timeline.member_ids, timeline.member_seconds([(edge_lo, edge_hi)])[0]):
+                member_seconds[member_id] = member_seconds.get(member_id, 0) + float(seconds)
+            switches += int(timeline.switch_counts([(edge_lo, edge_hi)], include_end)[0])
+        return member_seconds, switches
+
+    def window_totals(self, ranges, now_ts):
+        """
+        (fronting seconds per member ID, seconds covered by the history,
+        number of switches) for each (lo, hi) range in epoch seconds, hi
+        included. Complete hours come from the rollups; only the partial
+        hours at either end (and any hours not rolled up yet) are computed
+        from the switches.
+        """
+        self.refresh_rollups(now_ts)
+        results = []
+        with self._read_snapshot() as conn:
+            rollups = self._rollup_totals(conn)
+            # Hours invalidated since the running totals were read count as not rolled up
+            until = min(rollups.end, self._rollup_until(conn) or 0)
+            oldest = conn.execute("SELECT MIN(ts) FROM switches").fetchone()[0]
+            for lo, hi in ranges:
+                member_seconds, switches = self._totals(conn, rollups, until, lo, hi)
+                covered = max(0, hi - max(lo, oldest)) if oldest is not None else 0
+                results.append((member_seconds, covered, switches))
+        return results
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM switches").fetchone()[0]
+
+    @staticmethod
+    def _to_switch(row):
+        return {"id": row[0], "timestamp": row[1], "members": json.loads(row[2])}
+
+store = SwitchStore()
+
+# Bumped when the stored history is thrown away and downloaded again, so a
+# backfill still paging through the old history stops instead of finishing it
+_history_generation = 0
+_backfill_task = None
+
+async def _fetch_page(before=None):
+    params = {"limit": PAGE_SIZE}
+    if before:
+        params["before"] = before
+    return await get_json("/systems/@me/switches", params=params)
+
+async def iter_switch_pages(since=None, before=None):
+    """
+    Page through the switch history from PluralKit, newest first, yielding
+    one page (up to PAGE_SIZE switches) at a time so callers never hold
+    more than a page. Starts before the given timestamp, or at the newest
+    switch, and stops after the page that reaches back to since (epoch
+    seconds), or at the end of the history. The last page can include
+    switches older than since, among them the one active at since.
+    """
+    while True:
+        page = await _fetch_page(before)
+        if not page:
+            return
+        yield page
+        if len(page) < PAGE_SIZE or (since is not None and _epoch(page[-1]["timestamp"]) <= since):
+            return
+        before = page[-1]["timestamp"]
+
+async def _sync_new():
+    """Fetch the switches newer than the newest stored one"""
+    latest = store.latest()
+    latest_ts = latest["ts"] if latest else None
+    added = 0
+    first_page = True
+    # With nothing stored, only the newest page is fetched here; _backfill does the rest
+    async for page in iter_switch_pages(since=latest_ts if latest else float("inf")):
+        if first_page:
+            # The newest page is always re-read in full, so recent edits and
+            # deletions are picked up too
+            since_ts = _epoch(page[-1]["timestamp"]) if len(page) == PAGE_SIZE else float("-inf")
+            added += store.replace_newest(page, since_ts)
+            first_page = False
+        else:
+            added += store.add(page)
+    if first_page:
+        # PluralKit has no switches (any more)
+        store.replace_newest([], float("-inf"))
+    return added
+
+async def _backfill():
+    """Page back through the history until PluralKit has nothing older, resuming where a previous run stopped"""
+    if store.get_state("backfill_complete"):
+        return 0
+    added = 0
+    generation = _history_generation
+    # Every page is stored as it arrives, so an interrupted backfill resumes from the oldest stored switch
+    oldest = store.oldest()
+    async for page in iter_switch_pages(before=oldest["timestamp"] if oldest else None):
+        if generation != _history_generation:
+            return added
+        added += store.add(page)
+    store.set_state("backfill_complete", str(time.time()))
+    print(f"Switch history backfilled, {len(store)} switches stored")
+    # Rolling up a long history for the first time takes a moment
+    await asyncio.to_thread(store.refresh_rollups, time.time())
+    return added
+
+async def _sync():
+    added = await _sync_new()
+    await asyncio.to_thread(store.refresh_rollups, time.time())
+    return {"synced_at": time.time(), "added": added}
+
+async def sync():
+    """
+    Fetch the switches newer than the stored ones, at most once every
+    SWITCH_SYNC_INTERVAL seconds (and after anything invalidates
+    "switches"). Failures are logged; the stored history is still usable.
+    """
+    try:
+        await cached_fetch("switch_sync", _sync, ttl=SWITCH_SYNC_INTERVAL, tags=("switches",))
+    except Exception as e:
+        print(f"Error syncing switch history: {e}")
+
+async def backfill():
+    """
+    Download the history older than the stored switches, retrying every
+    SWITCH_SYNC_INTERVAL seconds until it is complete. Meant to run as a
+    background task: metrics cover the switches stored so far meanwhile.
+    """
+    while not store.get_state("backfill_complete"):
+        try:
+            await cached_fetch("switch_backfill", _backfill, ttl=SWITCH_SYNC_INTERVAL, tags=("switches",))
+        except Exception as e:
+            print(f"Error backfilling switch history: {e}")
+        if not store.get_state("backfill_complete"):
+            await asyncio.sleep(SWITCH_SYNC_INTERVAL)
+
+async def _backfill_in_background():
+    with low_priority():
+        await backfill()
+
+def _restart_backfill():
+    """Throw away the stored history and download it again in the background"""
+    global _history_generation, _backfill_task
+    _history_generation += 1
+    store.clear()
+    if _backfill_task is None or _backfill_task.done():
+        _backfill_task = asyncio.create_task(_backfill_in_background())
+
+async def apply_event(event_type, switch_id=None):
+    """Apply a PluralKit switch webhook event to the stored history"""
+    if event_type == "SUCCESSFUL_IMPORT":
+        # Imported switches can be older than the stored ones, which a sync never looks at
+        _restart_backfill()
+    elif event_type == "DELETE_ALL_SWITCHES":
+        store.clear()
+        store.set_state("backfill_complete", str(time.time()))
+    elif event_type == "DELETE_SWITCH" and switch_id:
+        store.delete([switch_id])
+    elif event_type == "UPDATE_SWITCH" and switch_id:
+        switch = await get_json(f"/systems/@me/switches/{switch_id}")
+        store.add([{
+            "id": switch["id"],
+            "timestamp": switch["timestamp"],
+            "members": [m["id"] if isinstance(m, dict) else m for m in switch.get("members", [])]
+        }])
@@ -0,0 +1,188 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# Checks of how fronters are cached around member changes, outages and
+# switches made with set_front, with the PluralKit calls replaced by
+# in-process stand-ins.
+#
+#   python tools/check_fronters_cache.py
+#
+# Exits non-zero and says which check failed.
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEMBERS = [
+    {"id": "aaaaa", "name": "Ash", "display_name": None, "avatar_url": None},
+    {"id": "bbbbb", "name": "Bea", "display_name": None, "avatar_url": None},
+]
+
+class FakePluralKit:
+    """Answers the calls pluralkit.py makes, and can be taken down"""
+
+    def __init__(self):
+        self.down = False
+        self.fronters = {"id": "s1", "timestamp": "2025-01-01T00:00:00.000000Z", "members": [MEMBERS[0]]}
+        self.members_version = 0
+        # Seconds a fronters fetch takes after reading the front, and a POST takes
+        self.fetch_delay = 0
+        self.post_delay = 0
+        self.posting = asyncio.Event()
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError("PluralKit is down")
+
+    async def get_json(self, path, **kwargs):
+        self._check()
+        assert path == "/systems/@me/fronters", path
+        fronters = {**self.fronters, "members": list(self.fronters["members"])}
+        await asyncio.sleep(self.fetch_delay)
+        return fronters
+
+    async def request(self, method, path, json=None, **kwargs):
+        self._check()
+        assert (method, path) == ("POST", "/systems/@me/switches"), (method, path)
+        self.posting.set()
+        await asyncio.sleep(self.post_delay)
+        by_id = {m["id"]: m for m in MEMBERS}
+        self.fronters = {
+            "id": f"s{self.members_version + 2}",
+            "timestamp": "2025-01-02T00:00:00.000000Z",
+            "members": [by_id[i] for i in json["members"]],
+        }
+        return FakeResponse(self.fronters)
+
+    async def get_json_conditional(self, path, params=None):
+        self._check()
+        assert path == "/systems/@me/members", path
+        # Every call after a change reports the list as changed once, like a 200 with a new body
+        changed = self.members_version != getattr(self, "_seen_version", None)
+        self._seen_version = self.members_version
+        return list(MEMBERS), changed
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.content = json.dumps(body).encode()
+        self.text = self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+async def check_member_change_keeps_fronters(pluralkit, cache, fake):
+    """The first fetch changes members_raw; fronters must still be cached and servable while PluralKit is down"""
+    fronters = await pluralkit.get_fronters()
+    if [m["id"] for m in fronters["members"]] != ["aaaaa"]:
+        return f"unexpected fronters {fronters}"
+    if not cache.lookup("fronters").hit:
+        return "fronters fetched alongside a member change were not cached"
+
+    # A member edit changes the list again; fronters refetched after it must be kept too
+    fake.members_version += 1
+    cache.invalidate("members")
+    await pluralkit.refresh_fronters()
+    if not cache.lookup("fronters").hit:
+        return "fronters refreshed alongside a member change were not cached"
+
+    # Let everything expire, then take PluralKit down
+    await asyncio.sleep(cache.CACHE_TTL + 0.2)
+    fake.down = True
+    stale_reads = cache.track_stale_reads()
+    try:
+        fronters = await pluralkit.get_fronters()
+    except Exception as e:
+        return f"get_fronters failed during the outage: {e!r}"
+    finally:
+        fake.down = False
+    if "fronters" not in stale_reads:
+        return "fronters during the outage were not served as stale data"
+    if [m["id"] for m in fronters["members"]] != ["aaaaa"]:
+        return f"unexpected stale fronters {fronters}"
+    return None
+
+async def check_set_front_beats_slow_fetch(pluralkit, cache, fake):
+    """A fronters fetch that reads the old front during a switch must not overwrite the new front"""
+    await pluralkit.get_fronters()
+    fake.fetch_delay = 0.3
+    fake.post_delay = 0.1
+
+    async def fetch_during_post():
+        await fake.posting.wait()
+        # Starts after set_front's first invalidate and finishes after it has cached the new front
+        return await pluralkit.refresh_fronters()
+
+    slow_fetch = asyncio.create_task(fetch_during_post())
+    await pluralkit.set_front(["bbbbb"])
+    old = await slow_fetch
+    if [m["id"] for m in old["members"]] != ["aaaaa"]:
+        return "the slow fetch didn't read the old front, so the check proved nothing"
+    cached = cache.lookup("fronters")
+    if not cached.hit:
+        return "the new front was not cached"
+    if [m["id"] for m in cached.value["members"]] != ["bbbbb"]:
+        return f"the slow fetch overwrote the new front with {cached.value['members']}"
+    return None
+
+CHECKS = [check_member_change_keeps_fronters, check_set_front_beats_slow_fetch]
+
+async def _run():
+    import cache
+    import pluralkit
+
+    failures = []
+    for check in CHECKS:
+        cache.flush_cache()
+        fake = FakePluralKit()
+        pluralkit.get_json = fake.get_json
+        pluralkit.get_json_conditional = fake.get_json_conditional
+        pluralkit.request = fake.request
+        problem = await check(pluralkit, cache, fake)
+        print(f"{'FAIL' if problem else 'ok  '} {check.__name__}{': ' + problem if problem else ''}")
+        if problem:
+            failures.append(check.__name__)
+    return failures
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        # Set before the backend modules read them at import time
+        os.environ["CACHE_BACKEND"] = "memory"
+        os.environ["CACHE_TTL"] = "1"
+        os.environ["CACHE_STALE_TTL"] = "0"
+        os.environ["AVATAR_PROXY"] = "false"
+        os.environ["SWITCH_DB_PATH"] = os.path.join(tmp, "switches.db")
+        sys.path.insert(0, BACKEND_DIR)
+        # Sub-system and tag files are created in the working directory
+        os.chdir(tmp)
+        failures = asyncio.run(_run())
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
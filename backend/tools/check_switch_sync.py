@@ -0,0 +1,159 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# End-to-end check of the switch store: serves a generated system from the
+# fake PluralKit, syncs it into a throwaway database and compares the
+# result with the fixture, including a switch made after the first sync and
+# one older than the whole stored history, as an import would add.
+#
+#   python tools/check_switch_sync.py --switches 1234
+#
+# Exits non-zero and says what differed if the store doesn't match.
+
+import os
+import sys
+import time
+import json
+import socket
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import threading
+
+import uvicorn
+
+import pk_fixtures
+import fake_pluralkit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _serve(fixture, port):
+    app = fake_pluralkit.create_app(fixture, fake_pluralkit.FakeSettings())
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("fake PluralKit did not start")
+        time.sleep(0.05)
+    return server
+
+async def _check(fixture):
+    import cache
+    import switch_store
+    import pluralkit_client
+    from datetime import datetime, timedelta
+
+    problems = []
+
+    def compare(label):
+        expected = {switch["id"]: switch for switch in fixture["switches"]}
+        with sqlite3.connect(switch_store.store.path) as conn:
+            stored = {row[0]: {"members": json.loads(row[1])} for row in conn.execute("SELECT id, members FROM switches")}
+        if stored.keys() != expected.keys():
+            problems.append(f"{label}: {len(stored)} switches stored, {len(expected)} expected")
+            return
+        changed = [i for i in expected if stored[i]["members"] != expected[i]["members"]]
+        if changed:
+            problems.append(f"{label}: members differ for {len(changed)} switches")
+
+    try:
+        await switch_store._sync()
+        await switch_store.backfill()
+        compare("first sync")
+
+        # A switch made after the first sync is picked up by the next one
+        member_ids = [fixture["members"][0]["id"], fixture["members"][1]["id"]]
+        resp = await pluralkit_client.request("POST", "/systems/@me/switches", json={"members": member_ids})
+        switch = resp.json()
+        fixture["switches"].insert(0, {"id": switch["id"], "timestamp": switch["timestamp"], "members": member_ids})
+        await switch_store._sync()
+        compare("second sync")
+
+        def count_rollups(label):
+            now_ts = time.time()
+            (_, _, switches), = switch_store.store.window_totals([(0, now_ts)], now_ts)
+            if switches != len(fixture["switches"]):
+                problems.append(f"{label} rollups: {switches} switches counted, {len(fixture['switches'])} expected")
+
+        count_rollups("second sync")
+
+        # An import can add switches older than anything stored, which only a new backfill finds
+        oldest = min(fixture["switches"], key=lambda s: s["timestamp"])
+        imported_at = datetime.fromisoformat(oldest["timestamp"].replace("Z", "+00:00")) - timedelta(days=1)
+        member_ids = [fixture["members"][2]["id"]]
+        resp = await pluralkit_client.request("POST", "/systems/@me/switches", json={
+            "members": member_ids,
+            "timestamp": imported_at.isoformat().replace("+00:00", "Z")
+        })
+        switch = resp.json()
+        fixture["switches"].append({"id": switch["id"], "timestamp": switch["timestamp"], "members": member_ids})
+        # As the webhook handler does before applying the event
+        cache.invalidate("switches")
+        await switch_store.apply_event("SUCCESSFUL_IMPORT")
+        await switch_store._backfill_task
+        compare("import")
+        count_rollups("import")
+    finally:
+        await pluralkit_client.shutdown()
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Check switch syncing against the fake PluralKit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--switches", type=int, default=1234)
+    args = parser.parse_args()
+
+    fixture = pk_fixtures.generate(args.seed, args.members, args.switches)
+    port = _free_port()
+    server = _serve(fixture, port)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The backend reads these at import time
+        os.environ["PLURALKIT_API_URL"] = f"http://127.0.0.1:{port}/v2"
+        os.environ["SYSTEM_TOKEN"] = "check-switch-sync"
+        os.environ["SWITCH_DB_PATH"] = os.path.join(tmp, "switches.db")
+        os.environ["CACHE_BACKEND"] = "memory"
+        sys.path.insert(0, BACKEND_DIR)
+        try:
+            problems = asyncio.run(_check(fixture))
+        finally:
+            server.should_exit = True
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        return 1
+    print(f"OK: {len(fixture['switches'])} switches synced")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# Sends PluralKit-style dispatch events to a local backend, for trying out
+# the webhook endpoint without registering it with PluralKit.
+#
+#   python tools/fake_dispatcher.py PING
+#   python tools/fake_dispatcher.py CREATE_SWITCH --members abcde fghij
+#   python tools/fake_dispatcher.py UPDATE_MEMBER --id abcde --data '{"name": "New"}'
+
+import os
+import sys
+import json
+import uuid
+import argparse
+from datetime import datetime, timezone
+
+import httpx
+from dotenv import load_dotenv
+
+EVENT_TYPES = [
+    "PING",
+    "UPDATE_SYSTEM",
+    "CREATE_MEMBER",
+    "UPDATE_MEMBER",
+    "DELETE_MEMBER",
+    "CREATE_SWITCH",
+    "UPDATE_SWITCH",
+    "DELETE_SWITCH",
+    "DELETE_ALL_SWITCHES",
+    "SUCCESSFUL_IMPORT",
+]
+
+def build_event(event_type, token, system_id, entity_id=None, data=None, members=None):
+    """Build a dispatch payload shaped like the ones PluralKit sends"""
+    event = {
+        "type": event_type,
+        "signing_token": token,
+        "system_id": system_id,
+    }
+    if event_type in ("CREATE_SWITCH", "UPDATE_SWITCH"):
+        entity_id = entity_id or str(uuid.uuid4())
+        data = data or {
+            "id": entity_id,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "members": members or [],
+        }
+    if entity_id:
+        event["id"] = entity_id
+    if data is not None:
+        event["data"] = data
+    return event
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Send a fake PluralKit dispatch event")
+    parser.add_argument("type", choices=EVENT_TYPES, help="event type to send")
+    parser.add_argument("--url", default="http://localhost:8000/api/pluralkit/webhook",
+                        help="webhook endpoint to post to")
+    parser.add_argument("--token", default=os.getenv("PK_WEBHOOK_TOKEN"),
+                        help="signing token (default: $PK_WEBHOOK_TOKEN)")
+    parser.add_argument("--system-id", default=str(uuid.uuid4()), help="system UUID")
+    parser.add_argument("--id", dest="entity_id", help="ID of the member or switch the event is about")
+    parser.add_argument("--data", help="event data as JSON")
+    parser.add_argument("--members", nargs="*", help="member IDs for switch events")
+    args = parser.parse_args()
+
+    if not args.token:
+        parser.error("no signing token; pass --token or set PK_WEBHOOK_TOKEN")
+
+    data = json.loads(args.data) if args.data else None
+    event = build_event(args.type, args.token, args.system_id, args.entity_id, data, args.members)
+
+    resp = httpx.post(args.url, json=event, timeout=10)
+    print(f"{resp.status_code} {resp.text}")
+    return 0 if resp.is_success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# Stand-in for the parts of the PluralKit v2 API the backend uses, for
+# offline development and repeatable load tests.
+#
+#   python tools/fake_pluralkit.py --port 8001 --latency 80 --rate-limit-rate 0.05
+#   PLURALKIT_API_URL=http://localhost:8001/v2 uvicorn main:app --port 8000
+#
+# Data comes from a fixture file (see pk_fixtures.py) or is generated from
+# --seed. Faults are drawn from the same seed, so a run can be repeated.
+
+import sys
+import uuid
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+import pk_fixtures
+
+# PluralKit's page size limit for /switches
+MAX_SWITCHES_PAGE = 100
+
+class FakeSettings:
+    def __init__(self, latency=0, jitter=0, error_rate=0.0, rate_limit_rate=0.0,
+                 enforce_limits=False, token=None, seed=0):
+        self.latency = latency                  # ms added to every response
+        self.jitter = jitter                    # ms of random extra latency
+        self.error_rate = error_rate            # fraction of requests answered with a 500
+        self.rate_limit_rate = rate_limit_rate  # fraction of requests answered with a 429
+        self.enforce_limits = enforce_limits    # apply PluralKit's 10/s read, 3/s write limits
+        self.token = token                      # required Authorization header, any if None
+        self.rng = random.Random(seed)
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def _error(status_code, message, headers=None, **extra):
+    return JSONResponse(
+        status_code=status_code,
+        content={"message": f"{status_code}: {message}", "code": 0, **extra},
+        headers=headers
+    )
+
+def create_app(fixture, settings):
+    app = FastAPI(title="Fake PluralKit")
+    system = fixture["system"]
+    members = {member["id"]: member for member in fixture["members"]}
+    # Newest first, as PluralKit returns them
+    switches = sorted(fixture["switches"], key=lambda s: _parse_timestamp(s["timestamp"]), reverse=True)
+    windows = {}
+
+    def expand(switch):
+        return {
+            "id": switch["id"],
+            "timestamp": switch["timestamp"],
+            "members": [members[member_id] for member_id in switch["members"] if member_id in members]
+        }
+
+    @app.middleware("http")
+    async def faults(request: Request, call_next):
+        delay = settings.latency + settings.rng.uniform(0, settings.jitter)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+
+        auth = request.headers.get("Authorization")
+        if not auth or (settings.token and auth != settings.token):
+            return _error(401, "Missing or invalid Authorization header")
+
+        is_read = request.method == "GET"
+        if settings.enforce_limits:
+            limit = 10 if is_read else 3
+            window = int(time.time())
+            key = (is_read, window)
+            windows[key] = windows.get(key, 0) + 1
+            for old in [k for k in windows if k[1] < window]:
+                del windows[old]
+            if windows[key] > limit:
+                reset = (window + 1) * 1000
+                return _error(429, "too many requests", retry_after=reset - int(time.time() * 1000),
+                              headers=_rate_limit_headers(limit, 0, reset))
+
+        roll = settings.rng.random()
+        if roll < settings.rate_limit_rate:
+            retry_after = settings.rng.randint(50, 1000)
+            return _error(429, "too many requests", retry_after=retry_after,
+                          headers=_rate_limit_headers(10 if is_read else 3, 0, int(time.time() * 1000) + retry_after))
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            return _error(500, "Internal server error")
+
+        return await call_next(request)
+
+    @app.get("/v2/systems/@me")
+    async def get_system():
+        return system
+
+    @app.get("/v2/systems/@me/members")
+    async def get_members():
+        return list(members.values())
+
+    @app.get("/v2/systems/@me/fronters")
+    async def get_fronters():
+        if not switches:
+            return Response(status_code=204)
+        return expand(switches[0])
+
+    @app.get("/v2/systems/@me/switches")
+    async def get_switches(before: str = None, limit: int = MAX_SWITCHES_PAGE):
+        if limit < 1:
+            return _error(400, "limit must be at least 1")
+        # Larger pages are cut down to the maximum
+        limit = min(limit, MAX_SWITCHES_PAGE)
+        page = switches
+        if before:
+            try:
+                cutoff = _parse_timestamp(before)
+            except ValueError:
+                return _error(400, "Invalid timestamp for 'before'")
+            page = [s for s in switches if _parse_timestamp(s["timestamp"]) < cutoff]
+        return page[:limit]
+
+    @app.post("/v2/systems/@me/switches")
+    async def post_switch(request: Request):
+        body = await request.json()
+        member_ids = body.get("members") or []
+        unknown = [member_id for member_id in member_ids if member_id not in members]
+        if unknown:
+            return _error(400, f"Member not found: {unknown[0]}")
+        if switches and sorted(switches[0]["members"]) == sorted(member_ids):
+            return _error(400, "Member list identical to current fronter list.")
+
+        timestamp = body.get("timestamp") or datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        switch = {"id": str(uuid.uuid4()), "timestamp": timestamp, "members": list(member_ids)}
+        switches.insert(0, switch)
+        switches.sort(key=lambda s: _parse_timestamp(s["timestamp"]), reverse=True)
+        return expand(switch)
+
+    return app
+
+def _rate_limit_headers(limit, remaining, reset_ms):
+    return {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset_ms),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake PluralKit v2 API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--fixture", help="fixture file to serve (default: generate one from --seed)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generated data and faults")
+    parser.add_argument("--members", type=int, default=40)
+    parser.add_argument("--switches", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0, help="ms added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="ms of random extra latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests failing with 429")
+    parser.add_argument("--enforce-limits", action="store_true", help="apply PluralKit's per-second rate limits")
+    parser.add_argument("--token", help="only accept this Authorization header")
+    args = parser.parse_args()
+
+    if args.fixture:
+        fixture = pk_fixtures.load(args.fixture)
+    else:
+        fixture = pk_fixtures.generate(args.seed, args.members, args.switches)
+    settings = FakeSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        enforce_limits=args.enforce_limits,
+        token=args.token,
+        seed=args.seed
+    )
+    uvicorn.run(create_app(fixture, settings), host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+MIT License
+
+Copyright (c) 2025 Clove Twilight
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# PluralKit system fixtures for the fake PluralKit server: either generated
+# from a seed, or recorded from the real API with SYSTEM_TOKEN.
+#
+#   python tools/pk_fixtures.py generate --seed 1 --members 40 --switches 5000 -o data/pk_fixture.json
+#   python tools/pk_fixtures.py record -o data/pk_fixture.json
+#
+# A fixture is a JSON object with "system", "members" and "switches" in the
+# shapes PluralKit's v2 API returns them; switches are sorted newest first
+# and list member IDs.
+
+import os
+import sys
+import json
+import uuid
+import random
+import string
+import argparse
+from datetime import datetime, timezone, timedelta
+
+import httpx
+from dotenv import load_dotenv
+
+# Names the backend treats specially (cofront parts and special display names)
+# are always included so their processing paths get exercised
+SPECIAL_NAMES = ["Rumi", "Zoey", "Mira", "system", "sleeping", "answer"]
+
+NAME_PARTS = [
+    "Ash", "Bea", "Cal", "Dee", "Eli", "Fen", "Gus", "Hal", "Ivy", "Jun",
+    "Kit", "Lux", "Max", "Nia", "Oak", "Pip", "Quin", "Rue", "Sky", "Tam",
+    "Uma", "Val", "Wren", "Xan", "Yas", "Zed"
+]
+
+PRONOUNS = ["she/her", "he/him", "they/them", "it/its", "any/all", None]
+
+def _short_id(rng, taken):
+    while True:
+        hid = "".join(rng.choice(string.ascii_lowercase) for _ in range(5))
+        if hid not in taken:
+            taken.add(hid)
+            return hid
+
+def _timestamp(dt):
+    return dt.isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+def generate(seed=0, members=40, switches=5000, days=365, now=None):
+    """
+    Build a fake system. The same arguments always give the same members and
+    switches; timestamps are relative to now unless now is given.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    created = now - timedelta(days=days + 30)
+    taken = set()
+
+    system_id = _short_id(rng, taken)
+    system_uuid = str(uuid.UUID(int=rng.getrandbits(128)))
+    system = {
+        "id": system_id,
+        "uuid": system_uuid,
+        "name": f"Test System {seed}",
+        "description": "Synthetic system for local testing",
+        "tag": None,
+        "pronouns": None,
+        "avatar_url": None,
+        "banner": None,
+        "color": "ff66cc",
+        "created": _timestamp(created),
+        "privacy": None,
+    }
+
+    names = list(SPECIAL_NAMES)
+    while len(names) < members:
+        name = rng.choice(NAME_PARTS) + rng.choice(NAME_PARTS).lower()
+        if name not in names:
+            names.append(name)
+    names = names[:members]
+
+    member_list = []
+    for name in names:
+        member_list.append({
+            "id": _short_id(rng, taken),
+            "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+            "system": system_id,
+            "name": name,
+            "display_name": None if rng.random() < 0.5 else f"{name} ✨",
+            "color": "".join(rng.choice("0123456789abcdef") for _ in range(6)),
+            "birthday": None,
+            "pronouns": rng.choice(PRONOUNS),
+            "avatar_url": None,
+            "webhook_avatar_url": None,
+            "banner": None,
+            "description": None,
+            "created": _timestamp(created + timedelta(days=rng.uniform(0, 30))),
+            "proxy_tags": [{"prefix": f"{name.lower()}:", "suffix": None}],
+            "keep_proxy": False,
+            "tts": False,
+            "autoproxy_enabled": True,
+            "message_count": rng.randint(0, 5000),
+            "last_message_timestamp": None,
+            "privacy": None,
+        })
+
+    # Spread the switches over the period; a few members front most often,
+    # like in a real system
+    member_ids = [m["id"] for m in member_list]
+    weights = [1 / (i + 1) for i in range(len(member_ids))]
+    start = now - timedelta(days=days)
+    offsets = sorted(rng.uniform(0, days * 86400) for _ in range(switches))
+    switch_list = []
+    for offset in offsets:
+        count = rng.choices([0, 1, 2, 3], weights=[1, 70, 20, 9])[0]
+        fronting = set()
+        while len(fronting) < min(count, len(member_ids)):
+            fronting.add(rng.choices(member_ids, weights=weights)[0])
+        switch_list.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "timestamp": _timestamp(start + timedelta(seconds=offset)),
+            "members": sorted(fronting),
+        })
+    switch_list.reverse()
+
+    return {"system": system, "members": member_list, "switches": switch_list}
+
+def record(token, base_url="https://api.pluralkit.me/v2"):
+    """Download the system, members and full switch history of the token's system"""
+    with httpx.Client(base_url=base_url, headers={"Authorization": token}, timeout=30) as client:
+        def get(path, **params):
+            resp = client.get(path, params=params)
+            resp.raise_for_status()
+            return resp.json()
+
+        system = get("/systems/@me")
+        members = get("/systems/@me/members")
+        switches = []
+        before = None
+        while True:
+            params = {"limit": 100}
+            if before:
+                params["before"] = before
+            page = get("/systems/@me/switches", **params)
+            switches.extend(page)
+            if len(page) < 100:
+                break
+            before = page[-1]["timestamp"]
+    return {"system": system, "members": members, "switches": switches}
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save(fixture, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, indent=2, ensure_ascii=False)
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Generate or record PluralKit fixtures")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="generate a synthetic system")
+    gen.add_argument("--seed", type=int, default=0)
+    gen.add_argument("--members", type=int, default=40)
+    gen.add_argument("--switches", type=int, default=5000)
+    gen.add_argument("--days", type=int, default=365)
+    gen.add_argument("-o", "--output", default="data/pk_fixture.json")
+
+    rec = sub.add_parser("record", help="record the real system of SYSTEM_TOKEN")
+    rec.add_argument("--token", default=os.getenv("SYSTEM_TOKEN"))
+    rec.add_argument("-o", "--output", default="data/pk_fixture.json")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        fixture = generate(args.seed, args.members, args.switches, args.days)
+    else:
+        if not args.token:
+            parser.error("no token; pass --token or set SYSTEM_TOKEN")
+        fixture = record(args.token)
+
+    save(fixture, args.output)
+    print(f"Wrote {len(fixture['members'])} members and {len(fixture['switches'])} switches to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
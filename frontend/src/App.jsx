@@ -162,13 +162,21 @@ function App() {
     // Function to fetch public data (members and fronters)
     const fetchPublicData = async () => {
       try {
-        // Fetch members data (with tags included)
-        const membersRes = await fetch("/api/members");
-        if (membersRes.ok) {
-          const data = await membersRes.json();
-          console.log("Members data from backend:", data);
+        // Fetch members, fronters and system info (including mental state) in one request
+        const res = await fetch("/api/bootstrap");
+        if (!res.ok) {
+          console.error("Error fetching data:", res.status);
+          return;
+        }
+        const data = await res.json();
+        console.log("Bootstrap data from backend:", data);
+        if (data.errors) {
+          console.error("Error fetching some data:", data.errors);
+        }
+
+        if (data.members) {
           // Sort members alphabetically by name
-          const sortedMembers = [...data].sort((a, b) => {
+          const sortedMembers = [...data.members].sort((a, b) => {
             // Use display_name if available, otherwise use name
             const nameA = (a.display_name || a.name).toLowerCase();
             const nameB = (b.display_name || b.name).toLowerCase();
@@ -176,30 +184,15 @@ function App() {
           });
           setMembers(sortedMembers);
           setFilteredMembers(sortedMembers);
-        } else {
-          console.error("Error fetching members:", membersRes.status);
         }
 
-        // Fetch current fronting member (if available)
-        const frontingRes = await fetch("/api/fronters");
-        if (frontingRes.ok) {
-          const data = await frontingRes.json();
-          console.log("Fronting member data:", data);
-          setFronting(data || { members: [] });
-        } else {
-          console.error("Error fetching fronters:", frontingRes.status);
+        // Current fronting member (if available)
+        if (!data.errors?.fronters) {
+          setFronting(data.fronters || { members: [] });
         }
 
-        // Fetch system info (including mental state)
-        const systemRes = await fetch("/api/system");
-        if (systemRes.ok) {
-          const data = await systemRes.json();
-          console.log("System data:", data);
-          if (data.mental_state) {
-            setMentalState(data.mental_state);
-          }
-        } else {
-          console.error("Error fetching system info:", systemRes.status);
+        if (data.mental_state) {
+          setMentalState(data.mental_state);
         }
       } catch (err) {
         console.error("Error fetching data:", err);